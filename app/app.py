@@ -1,39 +1,348 @@
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
-from stegimage import encoder, decoder
+from stegimage import aio, encoder, decoder
+from stegimage.fileio import PNG_STRATEGIES
+from stegimage.timing import record_timings, stage, summarize
+from threading import Lock
+from typing import List
+import asyncio
+import base64
+import bisect
 import io
+import json
 import os
+import time
+import zipfile
 
 app = FastAPI()
 
 dir = os.path.dirname(__file__)
 app.mount("/static", StaticFiles(directory=dir), name="static")
 
+# CPU-bound work runs on a bounded pool, PIL and NumPy release the GIL for the heavy parts
+MAX_WORKERS = int(os.environ.get("STEG_WORKERS", os.cpu_count() or 1))
+MAX_PENDING = int(os.environ.get("STEG_MAX_PENDING", 4*MAX_WORKERS))
+QUEUE_TIMEOUT = float(os.environ.get("STEG_QUEUE_TIMEOUT", 10))
+
+# PNG compression usually costs more than encoding, lower levels trade response size for latency
+PNG_COMPRESS_LEVEL = int(os.environ.get("STEG_PNG_COMPRESS_LEVEL", 6))
+PNG_STRATEGY = PNG_STRATEGIES[os.environ.get("STEG_PNG_STRATEGY", "default")]
+
+pool = aio.configure(max_workers=MAX_WORKERS, max_pending=MAX_PENDING, queue_timeout=QUEUE_TIMEOUT)
+
+async def run_in_pool(func, *args):
+    """
+    Runs func on the worker pool. Requests wait for a free slot for up to QUEUE_TIMEOUT seconds,
+    then get a 503 so a burst of uploads cannot pile up unbounded.
+    """
+
+    try:
+        # the worker runs in a copy of the request context, so its stages are recorded for the request
+        return await pool.run(func, *args)
+    except aio.PoolBusy:
+        raise HTTPException(status_code=503, detail="SERVER BUSY")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError:
+        # PIL.UnidentifiedImageError for uploads that are not images, OSError for truncated ones
+        raise HTTPException(status_code=400, detail="INVALID IMAGE")
+
+def parse_key(key) -> int:
+    try:
+        return int(key)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"INVALID KEY {key}")
+
+def to_png(img: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+
+    with stage("png_encode", img.size[0]*img.size[1]):
+        img.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL, compress_type=PNG_STRATEGY)
+
+    return buffer.getvalue()
+
+def encode_worker(string: str, data: bytes):
+    eim, key = encoder.encode_stencil(string, img=Image.open(io.BytesIO(data)))
+    return to_png(eim), key
+
+def decode_worker(key: int, data: bytes):
+    dim = decoder.decode_stencil(key, img=Image.open(io.BytesIO(data)))
+    return to_png(dim)
+
+def img_tag(png: bytes) -> str:
+    return f"<img src='data:image/png;base64,{base64.b64encode(png).decode()}'>"
+
+class Histogram:
+    """
+    Prometheus histogram with one series per label value, safe to observe from worker threads.
+    """
+
+    def __init__(self, name: str, help: str, label: str, buckets: List[float]):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = sorted(buckets)
+        self.series = {}
+        self.lock = Lock()
+
+    def observe(self, value: str, seconds: float, pixels: int=0):
+        with self.lock:
+            counts, total = self.series.get(value, ([0]*(len(self.buckets)+1), [0.0, 0, 0]))
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            total[0] += seconds
+            total[1] += 1
+            total[2] += pixels
+            self.series[value] = (counts, total)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            for value, (counts, (seconds, count, _)) in sorted(self.series.items()):
+                label = f'{self.label}="{value}"'
+                cumulative = 0
+
+                for bound, n in zip(self.buckets + [float("inf")], counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+
+                lines.append(f"{self.name}_sum{{{label}}} {seconds}")
+                lines.append(f"{self.name}_count{{{label}}} {count}")
+
+        return lines
+
+    def render_pixels(self, name: str, help: str) -> List[str]:
+        lines = [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+
+        with self.lock:
+            for value, (_, (_, _, pixels)) in sorted(self.series.items()):
+                lines.append(f'{name}{{{self.label}="{value}"}} {pixels}')
+
+        return lines
+
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+REQUEST_SECONDS = Histogram("stegimage_request_duration_seconds", "Request latency by route.", "route", BUCKETS)
+STAGE_SECONDS = Histogram("stegimage_stage_duration_seconds", "Duration of encoder and decoder stages.", "stage", BUCKETS)
+
+@app.middleware("http")
+async def timings(request: Request, call_next):
+    """
+    Records the stages of each request, reports them as Server-Timing and observes them in /metrics.
+    Streamed responses send their headers first, so only stages run before that are in Server-Timing.
+    """
+
+    start = time.perf_counter()
+
+    with record_timings(lambda t: STAGE_SECONDS.observe(t.stage, t.seconds, t.pixels)) as stages:
+        response = await call_next(request)
+
+    route = getattr(request.scope.get("route"), "path", "other")
+    REQUEST_SECONDS.observe(route, time.perf_counter()-start)
+
+    entries = [f"{name};dur={total['seconds']*1000:.3f}" for name, total in summarize(stages).items()]
+    entries.append(f"total;dur={(time.perf_counter()-start)*1000:.3f}")
+    response.headers["Server-Timing"] = ", ".join(entries)
+
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    lines = REQUEST_SECONDS.render() + STAGE_SECONDS.render()
+    lines += STAGE_SECONDS.render_pixels("stegimage_stage_pixels_total", "Pixels processed by encoder and decoder stages.")
+
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def home():
     return "app is running"
 
 @app.post("/encode/", response_class=HTMLResponse)
 async def encode_image(string: str= Form(), image: UploadFile = File()):
-    # Processing the image
-    image = Image.open(io.BytesIO(await image.read()))
-    # Your encoding logic here...
-    eim, key = encoder.encode_stencil(string, img=image)
-    
-    eim.save(f"{dir}/encoded_img.png")
-    content = f"<html><body><h1>{key}</h1><img src='/static/encoded_img.png'></body></html>"
+    # Processing the image off the event loop, the result never touches the disk
+    png, key = await run_in_pool(encode_worker, string, await image.read())
+
+    content = f"<html><body><h1>{key}</h1>{img_tag(png)}</body></html>"
     return HTMLResponse(content=content)
 
 @app.post("/decode/", response_class=HTMLResponse)
 async def decode_image(key: str = Form(), image: UploadFile = File()):
-    # Processing the image
-    image = Image.open(io.BytesIO(await image.read()))
-    # Your decoding logic here...
-    dim = decoder.decode_stencil(int(key), img=image)
-    dim.save(f"{dir}/decoded_img.png")
-    return f"<html><body><img src='/static/decoded_img.png'></body></html>"
+    # Processing the image off the event loop, the result never touches the disk
+    png = await run_in_pool(decode_worker, parse_key(key), await image.read())
+
+    return f"<html><body>{img_tag(png)}</body></html>"
+
+class ZipStream:
+    """
+    Write-only file object for zipfile that hands out the bytes written so far.
+    It cannot seek, so zipfile writes data descriptors and every entry can be sent as soon as it is written.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+async def read_uploads(images: List[UploadFile]):
+    """
+    Returns (name, load) pairs for the uploaded images, expanding ZIP uploads to their members,
+    and the manifest of the first ZIP upload holding one.
+    """
+
+    items, manifest = [], None
+
+    for image in images:
+        data = await image.read()
+
+        if (not zipfile.is_zipfile(io.BytesIO(data))):
+            items.append((image.filename, lambda data=data: data))
+            continue
+
+        archive = zipfile.ZipFile(io.BytesIO(data))
+
+        for name in archive.namelist():
+            if (name == "manifest.json"):
+                manifest = manifest or json.loads(archive.read(name))
+            elif (not name.endswith("/")):
+                # members are only decompressed on the worker pool
+                items.append((name, lambda archive=archive, name=name: archive.read(name)))
+
+    return items, manifest
+
+def output_name(name: str, used: set) -> str:
+    stem = os.path.splitext(os.path.basename(name or "image"))[0]
+    out, i = f"{stem}.png", 1
+
+    while (out in used):
+        out, i = f"{stem}_{i}.png", i+1
+
+    used.add(out)
+    return out
+
+async def run_batch(jobs):
+    """
+    Runs (name, func, args) jobs on the worker pool with at most MAX_WORKERS of them in flight,
+    yielding (name, result, error) as each one finishes.
+    """
+
+    jobs = iter(jobs)
+    running = {}
+
+    def submit():
+        for name, func, args in jobs:
+            running[asyncio.ensure_future(run_in_pool(func, *args))] = name
+
+            if (len(running) >= MAX_WORKERS):
+                break
+
+    try:
+        submit()
+
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name = running.pop(task)
+
+                try:
+                    yield name, task.result(), None
+                except HTTPException as e:
+                    yield name, None, e.detail
+                except Exception as e:
+                    yield name, None, str(e)
+
+            submit()
+    finally:
+        for task in running:
+            task.cancel()
+
+async def stream_zip(results, entry):
+    """
+    Streams a ZIP holding a PNG for each successful result, written as soon as it finishes, and a manifest.json.
+    entry maps a result to its PNG and its manifest fields.
+    """
+
+    stream = ZipStream()
+    manifest = []
+    used = {"manifest.json"}
+
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive:
+        async for name, result, error in results:
+            if (error is not None):
+                manifest.append({"source": name, "error": error})
+                continue
+
+            png, fields = entry(result)
+            out = output_name(name, used)
+            archive.writestr(out, png)
+            manifest.append({"name": out, "source": name, **fields})
+
+            yield stream.take()
+
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+
+    yield stream.take()
+
+def zip_response(chunks, filename: str) -> StreamingResponse:
+    return StreamingResponse(chunks, media_type="application/zip", headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+def lazy(worker, *args):
+    """
+    Calls worker with args and the loaded image data, loading it on the worker pool.
+    """
+
+    *args, load = args
+    return worker(*args, load())
+
+@app.post("/encode/batch")
+async def encode_batch(string: str = Form(), images: List[UploadFile] = File()):
+    # images may be uploaded one by one or as a ZIP
+    items, _ = await read_uploads(images)
+
+    jobs = ((name, lazy, (encode_worker, string, load)) for name, load in items)
+    entry = lambda result: (result[0], {"key": result[1]})
+
+    return zip_response(stream_zip(run_batch(jobs), entry), "encoded.zip")
+
+@app.post("/decode/batch")
+async def decode_batch(keys: str = Form(None), images: List[UploadFile] = File()):
+    # keys are read from the manifest of a ZIP returned by /encode/batch, or given as
+    # one key for all images or one per image, separated by commas
+    items, manifest = await read_uploads(images)
+    manifest_keys = {m["name"]: m["key"] for m in manifest or [] if "key" in m}
+    form_keys = [k.strip() for k in keys.split(",")] if keys else []
+
+    def key_for(i, name):
+        if (name in manifest_keys):
+            return parse_key(manifest_keys[name])
+        elif (len(form_keys) == 1):
+            return parse_key(form_keys[0])
+        elif (len(form_keys) == len(items)):
+            return parse_key(form_keys[i])
+
+        raise HTTPException(status_code=400, detail=f"MISSING KEY FOR {name}")
+
+    jobs = [(name, lazy, (decode_worker, key_for(i, name), load)) for i, (name, load) in enumerate(items)]
+    entry = lambda result: (result, {})
+
+    return zip_response(stream_zip(run_batch(jobs), entry), "decoded.zip")
 
 if __name__ == "__main__":
     import uvicorn
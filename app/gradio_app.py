@@ -1,17 +1,43 @@
 import gradio as gr
-from stegimage import encoder, decoder
+import os
+from stegimage import batch
 
-def encode_interface(image, message):
-    print("encoding image")
-    eim, key = encoder.encode_stencil(message, img=image)
+# concurrent requests are grouped into batches of up to MAX_BATCH_SIZE and processed in one call
+MAX_BATCH_SIZE = int(os.environ.get("STEG_MAX_BATCH_SIZE", 16))
+CONCURRENCY = int(os.environ.get("STEG_CONCURRENCY", os.cpu_count() or 1))
+MAX_QUEUE = int(os.environ.get("STEG_MAX_QUEUE", 256))
 
-    return eim, key
+def warn_failed(results):
+    # a failed item leaves its outputs empty without failing the rest of the batch
+    for r in results:
+        if (isinstance(r, Exception)):
+            gr.Warning(str(r))
 
-def decode_interface(image, key):
-    print("decoding image")
-    dim = decoder.decode_stencil(key, img=image)
+def encode_interface(images, messages):
+    print(f"encoding {len(images)} images")
+    results = batch.encode_stencil_many(messages, images)
+    warn_failed(results)
 
-    return dim
+    results = [(None, None) if isinstance(r, Exception) else r for r in results]
+
+    return [eim for eim, _ in results], [key for _, key in results]
+
+def decode_interface(images, keys):
+    print(f"decoding {len(images)} images")
+
+    # a blank key is reported rather than decoded as 0
+    present = [i for i, key in enumerate(keys) if key is not None]
+    decoded = batch.decode_stencil_many([int(keys[i]) for i in present], [images[i] for i in present])
+
+    results = [ValueError("MUST PROVIDE KEY")]*len(keys)
+
+    for i, r in zip(present, decoded):
+        results[i] = r
+
+    warn_failed(results)
+
+    # one list per output component
+    return [[None if isinstance(r, Exception) else r for r in results]]
 
 
 with gr.Blocks() as demo:
@@ -21,13 +47,16 @@ with gr.Blocks() as demo:
     encoded_img = gr.Image(format="png")
     key = gr.Number("key")
 
-    encode_btn.click(encode_interface, inputs=[image, message], outputs=[encoded_img, key])
+    encode_btn.click(encode_interface, inputs=[image, message], outputs=[encoded_img, key],
+                     batch=True, max_batch_size=MAX_BATCH_SIZE, concurrency_limit=CONCURRENCY)
 
     eimg = gr.Image(type="pil")
     dkey = gr.Number("key")
     decode_btn = gr.Button("Decode")
     dimg = gr.Image(type='pil')
 
-    decode_btn.click(decode_interface, inputs=[eimg, dkey], outputs=dimg)
+    decode_btn.click(decode_interface, inputs=[eimg, dkey], outputs=dimg,
+                     batch=True, max_batch_size=MAX_BATCH_SIZE, concurrency_limit=CONCURRENCY)
 
-demo.launch()
\ No newline at end of file
+demo.queue(max_size=MAX_QUEUE)
+demo.launch()
@@ -0,0 +1,227 @@
+"""
+Benchmarks the public encoders and decoders over a matrix of synthetic image and payload sizes.
+
+Records the best wall time of a few runs, pixels/s and peak traced memory for each case, writes the
+results as JSON and, given a baseline, exits with status 1 if any case got slower or used more memory than
+the thresholds allow. benchmarks/baseline.json holds the small and 1mp sizes, run with one worker.
+
+    python benchmarks/bench.py --output results.json
+    python benchmarks/bench.py --sizes small 1mp --baseline benchmarks/baseline.json --threshold 0.2 --memory-threshold 0.1
+    python benchmarks/bench.py --sizes small 1mp --save-baseline benchmarks/baseline.json
+    python benchmarks/bench.py --sizes 50mp --workers 8
+"""
+
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from stegimage import __version__, encode_text, decode_text, encode_stencil, decode_stencil
+
+# (length, height) of the synthetic images
+SIZES = {
+    "small": (256, 256),
+    "1mp": (1000, 1000),
+    "12mp": (4000, 3000),
+    "50mp": (8660, 5773),
+}
+
+# payload sizes in bytes for the text functions, and in characters for the stencil functions
+TEXT_PAYLOADS = [1024, 65536, 1048576]
+STENCIL_PAYLOADS = [4, 16]
+STENCIL_TEXT_SIZE = 50
+
+# peak memory growth below this is noise from the allocator rather than a regression
+MIN_MEMORY_GROWTH = 1 << 20
+
+def make_image(length: int, height: int, seed: int=0) -> Image.Image:
+    # smooth gradient plus noise, closer to a photo than pure noise
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 247, length, dtype=np.float32)
+    y = np.linspace(0, 247, height, dtype=np.float32)[:, None]
+    arr = np.empty((height, length, 3), dtype=np.uint8)
+    arr[..., 0] = (x + y) / 2
+    arr[..., 1] = x
+    arr[..., 2] = y
+    arr += rng.integers(0, 8, size=arr.shape, dtype=np.uint8)
+
+    return Image.fromarray(arr)
+
+def make_text(num_chars: int, seed: int=0) -> str:
+    rng = np.random.default_rng(seed)
+    return "".join(map(chr, rng.integers(ord("a"), ord("z") + 1, size=num_chars)))
+
+def make_log(num_bytes: int, seed: int=0) -> str:
+    # JSON log lines, which compress about as well as real payloads
+    rng = np.random.default_rng(seed)
+    lines = (json.dumps({"id": int(i), "level": "info", "latency_ms": int(ms), "message": "request served"})
+             for i, ms in enumerate(rng.integers(1, 500, size=num_bytes // 40 + 1)))
+
+    return "\n".join(lines)[:num_bytes]
+
+def measure(func, repeat: int) -> dict:
+    """
+    Returns the best wall time of repeat calls, then the peak traced memory of one more call.
+    """
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    # traced separately, tracemalloc slows down allocations
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": best, "peak_bytes": peak}
+
+def cases(sizes: list, workers: int=1):
+    """
+    Yields (name, size, payload, func) for every case, skipping payloads that do not fit the image.
+    The encoders and decode_stencil shard their work over workers threads.
+    """
+
+    for size in sizes:
+        length, height = SIZES[size]
+        img = make_image(length, height)
+
+        for payload in TEXT_PAYLOADS:
+            if (payload * 8 > length * height):
+                continue
+
+            text = make_text(payload)
+            encoded, key = encode_text(text, img=img)
+
+            yield "encode_text", size, payload, lambda text=text: encode_text(text, img=img, workers=workers)
+            yield "decode_text", size, payload, lambda encoded=encoded, key=key: decode_text(key, img=encoded)
+
+            # error correction embeds 14 bits per byte instead of 8
+            if (payload * 14 > length * height):
+                continue
+
+            encoded, key = encode_text(text, img=img, ecc=True)
+
+            yield "encode_text_ecc", size, payload, lambda text=text: encode_text(text, img=img, ecc=True, workers=workers)
+            yield "decode_text_ecc", size, payload, lambda encoded=encoded, key=key: decode_text(key, img=encoded)
+
+        # compressible payloads, which may exceed the raw capacity of the image
+        for payload in TEXT_PAYLOADS:
+            log = make_log(payload)
+
+            try:
+                encoded, key = encode_text(log, img=img, compression="zlib")
+            except ValueError:
+                continue
+
+            yield "encode_text_zlib", size, payload, lambda log=log: encode_text(log, img=img, compression="zlib", workers=workers)
+            yield "decode_text_zlib", size, payload, lambda encoded=encoded, key=key: decode_text(key, img=encoded)
+
+        for payload in STENCIL_PAYLOADS:
+            text = make_text(payload)
+
+            try:
+                encoded, key = encode_stencil(text, img=img, text_size=STENCIL_TEXT_SIZE)
+            except ValueError:
+                continue
+
+            yield "encode_stencil", size, payload, lambda text=text: encode_stencil(text, img=img, text_size=STENCIL_TEXT_SIZE, workers=workers)
+            yield "decode_stencil", size, payload, lambda encoded=encoded, key=key: decode_stencil(key, img=encoded, workers=workers)
+
+def run(sizes: list, repeat: int, workers: int=1) -> dict:
+    results = []
+
+    for name, size, payload, func in cases(sizes, workers):
+        length, height = SIZES[size]
+        result = measure(func, repeat)
+        result["pixels_per_s"] = length * height / result["seconds"]
+        results.append({"name": name, "size": size, "payload": payload, **result})
+
+        print(f"{name:16} {size:6} {payload:>8}  {result['seconds']*1000:10.2f} ms  "
+              f"{result['pixels_per_s']/1e6:10.1f} MP/s  {result['peak_bytes']/2**20:8.1f} MiB")
+
+    return {
+        "meta": {
+            "stegimage": __version__,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": repeat,
+            "workers": workers,
+        },
+        "results": results,
+    }
+
+def compare(results: dict, baseline: dict, threshold: float, memory_threshold: float) -> list:
+    """
+    Returns a message for every case slower than its baseline time by more than threshold, or with a peak
+    memory above its baseline by more than memory_threshold (both fractions).
+    """
+
+    base = {(r["name"], r["size"], r["payload"]): r for r in baseline["results"]}
+    regressions = []
+
+    for r in results["results"]:
+        b = base.get((r["name"], r["size"], r["payload"]))
+
+        if (b is None):
+            continue
+
+        ratio = r["seconds"] / b["seconds"]
+
+        if (ratio > 1 + threshold):
+            regressions.append(f"{r['name']} {r['size']} {r['payload']}: "
+                               f"{b['seconds']*1000:.2f} ms -> {r['seconds']*1000:.2f} ms ({ratio:.2f}x)")
+
+        growth = r["peak_bytes"] - b["peak_bytes"]
+
+        if (growth > max(memory_threshold * b["peak_bytes"], MIN_MEMORY_GROWTH)):
+            regressions.append(f"{r['name']} {r['size']} {r['payload']}: "
+                               f"{b['peak_bytes']/2**20:.1f} MiB -> {r['peak_bytes']/2**20:.1f} MiB peak memory")
+
+    return regressions
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark the stegimage encoders and decoders.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES), help="image sizes to run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best is kept")
+    parser.add_argument("--workers", type=int, default=1, help="threads the encoders and decode_stencil shard their work over")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline, as a fraction")
+    parser.add_argument("--memory-threshold", type=float, default=0.1, help="allowed peak memory growth against the baseline, as a fraction")
+    parser.add_argument("--save-baseline", type=Path, help="write the results as the new baseline")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = run(args.sizes, args.repeat, args.workers)
+
+    for path in (args.output, args.save_baseline):
+        if (path is not None):
+            path.write_text(json.dumps(results, indent=2))
+
+    if (args.baseline is None):
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold, args.memory_threshold)
+
+    for message in regressions:
+        print(f"REGRESSION {message}", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
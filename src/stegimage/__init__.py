@@ -1,4 +1,8 @@
 __version__ = "0.0.1"
 
-from .encoder import encode_stencil, encode_text
-from .decoder import decode_stencil, decode_text
\ No newline at end of file
+from .encoder import encode_stencil, encode_text, encode_bytes, encode_stream, encode_frames
+from .decoder import decode_stencil, decode_text, decode_bytes, decode_stream, decode_frames, read_header, scan_stencil_keys
+from .batch import encode_batch, decode_batch
+from .cache import cache_stats
+from .timing import record_timings, summarize, Timing
+from .aio import aencode_text, adecode_text, aencode_stencil, adecode_stencil
\ No newline at end of file
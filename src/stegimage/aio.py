@@ -0,0 +1,126 @@
+import asyncio
+import contextvars
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+
+from .encoder import encode_stencil, encode_text
+from .decoder import decode_stencil, decode_text
+
+class PoolBusy(Exception):
+    """
+    Raised when a call waited queue_timeout seconds without getting a slot in the worker pool.
+    """
+
+class WorkerPool:
+    """
+    Bounded thread pool for the coroutines. At most max_pending calls are queued or running,
+    later calls wait up to queue_timeout seconds for a slot, so bursts apply backpressure instead of piling up.
+    """
+
+    def __init__(self, max_workers: int=None, max_pending: int=None, queue_timeout: float=None):
+        """
+        Parameters: max_workers is the number of threads (default: number of CPUs), max_pending the number of calls
+        queued or running at once (default: 4*max_workers) and queue_timeout the seconds a call waits for a slot (default: no limit).
+        NumPy and Pillow release the GIL for the heavy parts, so threads run the work in parallel.
+        """
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4*self.max_workers
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stegimage")
+
+        # asyncio semaphores belong to one event loop, so the limit is kept per loop
+        self._slots = weakref.WeakKeyDictionary()
+
+    async def run(self, func: Callable, *args, timeout: float=None, **kwargs):
+        """
+        Runs func(*args, **kwargs) on the pool and returns its result.
+
+        Raises PoolBusy if no slot frees up within queue_timeout, and asyncio.TimeoutError if the call takes longer
+        than timeout seconds. A call cancelled or timed out before it started never runs; one already running
+        finishes in the background and keeps its slot until then, so memory stays bounded.
+        """
+
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+
+        if (slots is None):
+            slots = self._slots[loop] = asyncio.Semaphore(self.max_pending)
+
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise PoolBusy("WORKER POOL IS BUSY") from None
+
+        # the call runs in a copy of the caller's context, so record_timings covers it
+        context = contextvars.copy_context()
+
+        try:
+            future = self.executor.submit(context.run, partial(func, *args, **kwargs))
+        except BaseException:
+            slots.release()
+            raise
+
+        def release(_):
+            if (not loop.is_closed()):
+                loop.call_soon_threadsafe(slots.release)
+
+        future.add_done_callback(release)
+
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def shutdown(self, wait: bool=True) -> None:
+        self.executor.shutdown(wait=wait)
+
+_POOL = None
+
+def configure(max_workers: int=None, max_pending: int=None, queue_timeout: float=None) -> WorkerPool:
+    """
+    Replaces the shared worker pool used by the coroutines, letting calls already submitted to the old one finish.
+    """
+
+    global _POOL
+    old, _POOL = _POOL, WorkerPool(max_workers, max_pending, queue_timeout)
+
+    if (old is not None):
+        old.shutdown(wait=False)
+
+    return _POOL
+
+def get_pool() -> WorkerPool:
+    """
+    Returns the shared worker pool, created with the defaults on first use.
+    """
+
+    return _POOL or configure()
+
+async def aencode_text(*args, timeout: float=None, **kwargs):
+    """
+    Coroutine version of encode_text, run on the shared worker pool. See WorkerPool.run for timeout and errors.
+    """
+
+    return await get_pool().run(encode_text, *args, timeout=timeout, **kwargs)
+
+async def adecode_text(*args, timeout: float=None, **kwargs):
+    """
+    Coroutine version of decode_text, run on the shared worker pool. See WorkerPool.run for timeout and errors.
+    """
+
+    return await get_pool().run(decode_text, *args, timeout=timeout, **kwargs)
+
+async def aencode_stencil(*args, timeout: float=None, **kwargs):
+    """
+    Coroutine version of encode_stencil, run on the shared worker pool. See WorkerPool.run for timeout and errors.
+    """
+
+    return await get_pool().run(encode_stencil, *args, timeout=timeout, **kwargs)
+
+async def adecode_stencil(*args, timeout: float=None, **kwargs):
+    """
+    Coroutine version of decode_stencil, run on the shared worker pool. See WorkerPool.run for timeout and errors.
+    """
+
+    return await get_pool().run(decode_stencil, *args, timeout=timeout, **kwargs)
@@ -0,0 +1,139 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from PIL import Image
+from typing import Iterable, List, Tuple, Union
+
+from .encoder import encode_stencil, encode_text, encode_bytes
+from .decoder import decode_stencil, decode_text, decode_bytes
+
+ENCODERS = {"text": encode_text, "bytes": encode_bytes, "stencil": encode_stencil}
+DECODERS = {"text": decode_text, "bytes": decode_bytes, "stencil": decode_stencil}
+
+def _image_kwargs(image: Union[str, Image.Image, np.ndarray]) -> dict:
+    """
+    Maps a path, image object or array to the matching image argument.
+    """
+
+    if (isinstance(image, (Image.Image, np.ndarray))):
+        return {"img": image}
+
+    return {"img_path": image}
+
+def _encode_item(item: Tuple, method: str, kwargs: dict):
+    """
+    Encodes a single (image, text) item, returning the exception instead of raising it.
+    """
+
+    image, text = item
+
+    try:
+        return ENCODERS[method](text, **_image_kwargs(image), **kwargs)
+    except Exception as e:
+        return e
+
+def _decode_item(item: Tuple, method: str, kwargs: dict):
+    """
+    Decodes a single (image, key) item, returning the exception instead of raising it.
+    """
+
+    image, key = item
+
+    try:
+        return DECODERS[method](key, **_image_kwargs(image), **kwargs)
+    except Exception as e:
+        return e
+
+def _run(func, items: Iterable[Tuple], executor: Executor, max_workers: int, chunksize: int) -> List:
+    """
+    Maps func over items on the given executor, or on a new process pool.
+    """
+
+    if (executor is not None):
+        return list(executor.map(func, items, chunksize=chunksize))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(func, items, chunksize=chunksize))
+
+def encode_batch(items: Iterable[Tuple], method: str="text", max_workers: int=None, chunksize: int=1, executor: Executor=None, **kwargs) -> List:
+    """
+    Encodes many images in parallel.
+
+    Args:
+        items (Iterable[tuple]): Pairs of image (path, Image.Image or np.ndarray) and the text to encode into it.
+        method (str, optional): "text", "bytes" or "stencil" to use encode_text, encode_bytes or encode_stencil. Defaults to "text".
+        max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunksize (int, optional): Number of items sent to a worker at a time. Defaults to 1.
+        executor (Executor, optional): An existing executor to run on instead of a new process pool. Defaults to None.
+        **kwargs: Extra arguments passed to the encoder, e.g. text_size and text_coords.
+
+    Returns:
+        list: For each item, in order, the (image, key) tuple returned by the encoder or the exception it raised.
+
+    Raises:
+        ValueError: If method is not "text", "bytes" or "stencil".
+
+    Example:
+        results = encode_batch([("a.png", "hello"), ("b.png", "world")], method="stencil", max_workers=4)
+    """
+
+    if (method not in ENCODERS):
+        raise ValueError("METHOD MUST BE ONE OF text, bytes OR stencil")
+
+    return _run(partial(_encode_item, method=method, kwargs=kwargs), items, executor, max_workers, chunksize)
+
+def decode_batch(items: Iterable[Tuple], method: str="text", max_workers: int=None, chunksize: int=1, executor: Executor=None, **kwargs) -> List:
+    """
+    Decodes many images in parallel.
+
+    Args:
+        items (Iterable[tuple]): Pairs of image (path, Image.Image or np.ndarray) and the key to decode it with.
+        method (str, optional): "text", "bytes" or "stencil" to use decode_text, decode_bytes or decode_stencil. Defaults to "text".
+        max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunksize (int, optional): Number of items sent to a worker at a time. Defaults to 1.
+        executor (Executor, optional): An existing executor to run on instead of a new process pool. Defaults to None.
+        **kwargs: Extra arguments passed to the decoder, e.g. output.
+
+    Returns:
+        list: For each item, in order, the result of the decoder or the exception it raised.
+
+    Raises:
+        ValueError: If method is not "text", "bytes" or "stencil".
+    """
+
+    if (method not in DECODERS):
+        raise ValueError("METHOD MUST BE ONE OF text, bytes OR stencil")
+
+    return _run(partial(_decode_item, method=method, kwargs=kwargs), items, executor, max_workers, chunksize)
+
+def encode_stencil_many(texts: List[str], imgs: List, text_size: int=50, text_coords: Tuple=(0, 0)) -> List:
+    """
+    Encodes texts into images as stencils in one call, returning per-image errors as results.
+
+    Args:
+        texts (list[str]): The text to encode into each image.
+        imgs (list): The images, as paths, Image.Image objects or HxWx3 uint8 arrays.
+        text_size (int, optional): The size of the text in pixels. Defaults to 50.
+        text_coords (tuple, optional): The coordinates (x, y) of the top-left corner of the text. Defaults to (0, 0).
+
+    Returns:
+        list: For each image, in order, the (image, key) tuple returned by encode_stencil or the exception it raised.
+    """
+
+    kwargs = {"text_size": text_size, "text_coords": text_coords}
+
+    return [_encode_item((img, text), "stencil", kwargs) for text, img in zip(texts, imgs)]
+
+def decode_stencil_many(keys: List[int], imgs: List) -> List:
+    """
+    Decodes stencils from images in one call, returning per-image errors as results.
+
+    Args:
+        keys (list[int]): The key of each image.
+        imgs (list): The images, as paths, Image.Image objects or HxWx3 uint8 arrays.
+
+    Returns:
+        list: For each image, in order, the image returned by decode_stencil or the exception it raised.
+    """
+
+    return [_decode_item((img, key), "stencil", {}) for key, img in zip(keys, imgs)]
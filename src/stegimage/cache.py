@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Hashable
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache, bounded by the total size of its values.
+    """
+
+    def __init__(self, max_size: int, sizeof: Callable=lambda value: 1):
+        """
+        Parameters: max_size is the bound on the total size of the values, sizeof returns the size of a value
+        (by default every value has size 1, bounding the number of entries).
+        """
+
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, create: Callable):
+        """
+        Returns the value cached under key, or creates it with create() and caches it.
+        """
+
+        with self._lock:
+            if (key in self._data):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+
+            self.misses += 1
+
+        # created outside the lock so other keys are not blocked, a concurrent miss may create it twice
+        value = create()
+        size = self.sizeof(value)
+
+        with self._lock:
+            if (key not in self._data and size <= self.max_size):
+                self._data[key] = (value, size)
+                self._size += size
+                self._evict()
+
+        return value
+
+    def resize(self, max_size: int) -> None:
+        """
+        Changes the bound on the total size of the values, evicting the least recently used ones.
+        """
+
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self) -> None:
+        """
+        Removes all values and resets the stats.
+        """
+
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        Returns hit, miss and eviction counts along with the number of entries and their total size.
+        """
+
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._data), "size": self._size, "max_size": self.max_size}
+
+    def _evict(self) -> None:
+        while (self._size > self.max_size):
+            _, (_, size) = self._data.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+
+# fonts keyed by text size, bounded by number of fonts
+FONT_CACHE = LRUCache(32)
+
+# rendered text masks keyed by (text, text size), bounded by bytes
+MASK_CACHE = LRUCache(64*1024*1024, sizeof=lambda mask: mask.nbytes)
+
+# scattered pixel indexes keyed by (seed, image shape, offset, payload pixels), bounded by bytes
+INDEX_CACHE = LRUCache(64*1024*1024, sizeof=lambda index: index.nbytes)
+
+def cache_stats() -> dict:
+    """
+    Returns the stats of the font, text mask and scatter index caches.
+    """
+
+    return {"fonts": FONT_CACHE.stats(), "masks": MASK_CACHE.stats(), "indexes": INDEX_CACHE.stats()}
@@ -0,0 +1,343 @@
+import glob
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterable, Iterator, List, Tuple
+
+from .encoder import encode_stencil, encode_text
+from .decoder import decode_bytes, decode_stencil, scan_stencil_keys
+from .compression import CODECS
+from .fileio import PNG_STRATEGIES, open_image, save_image
+from .helper import TextKey
+
+IMAGE_EXTENSIONS = {".png", ".bmp", ".tif", ".tiff", ".jpg", ".jpeg", ".webp", ".gif", ".npy"}
+
+def expand_inputs(inputs: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (path, name) for every image in the given files, globs or directories.
+    name is the path relative to the directory it was found in, or to the part of the glob before its first wildcard, used to name outputs.
+    """
+
+    for pattern in inputs:
+        if (os.path.isdir(pattern)):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+
+                for file in sorted(files):
+                    if (os.path.splitext(file)[1].lower() in IMAGE_EXTENSIONS):
+                        path = os.path.join(root, file)
+                        yield path, os.path.relpath(path, pattern)
+        elif (os.path.isfile(pattern)):
+            yield pattern, os.path.basename(pattern)
+        else:
+            root = glob_root(pattern)
+
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if (os.path.isfile(path)):
+                    yield path, os.path.relpath(path, root)
+
+def glob_root(pattern: str) -> str:
+    """
+    Returns the directory of a glob pattern before its first component with a wildcard.
+    """
+
+    parts = os.path.normpath(pattern).split(os.sep)
+    fixed = []
+
+    for part in parts[:-1]:
+        if (glob.has_magic(part)):
+            break
+
+        fixed.append(part)
+
+    return os.sep.join(fixed) or ("/" if pattern.startswith("/") else ".")
+
+def output_path(output_dir: str, name: str, extension: str) -> str:
+    return os.path.join(output_dir, os.path.splitext(name)[0] + extension)
+
+def read_manifest(path: str) -> dict:
+    """
+    Returns the records of a JSONL manifest by source, skipping a truncated last line.
+    """
+
+    records = {}
+
+    if (path is None or not os.path.exists(path)):
+        return records
+
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            records[record["source"]] = record
+
+    return records
+
+def image_arg(source: str) -> dict:
+    """
+    Maps a path to the image argument, memory-mapping .npy arrays.
+    """
+
+    if (source.lower().endswith(".npy")):
+        return {"img": open_image(source)}
+
+    return {"img_path": source}
+
+def text_key(record: dict) -> TextKey:
+    return TextKey(record["key"], record.get("bits", 1), record.get("channels", "G"), record.get("header", False), record.get("ecc", False), record.get("compression"))
+
+def _encode(task: Tuple) -> dict:
+    source, output, _, options = task
+
+    if (options["method"] == "stencil"):
+        img, key = encode_stencil(options["text"], **image_arg(source), text_size=options["text_size"], text_coords=options["text_coords"])
+        record = {"key": key}
+    else:
+        img, key = encode_text(options["text"], **image_arg(source), bits=options["bits"], channels=options["channels"], header=options["header"], ecc=options["ecc"],
+                               compression=options["compression"], compression_level=options["compression_level"])
+        record = {"key": int(key), "bits": key.bits, "channels": key.channels, "header": key.header, "ecc": key.ecc, "compression": key.compression}
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    save_image(img, output, compress_level=options["compress_level"], strategy=options["strategy"])
+
+    return {"source": source, "output": output, **record}
+
+def _decode(task: Tuple) -> dict:
+    source, output, key, options = task
+
+    if (options["method"] == "stencil"):
+        if (key is None):
+            raise ValueError("MISSING KEY")
+
+        result = decode_stencil(key, **image_arg(source))
+    else:
+        result = decode_bytes(key, **image_arg(source))
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    if (options["method"] == "stencil"):
+        # .npy inputs are decoded as arrays
+        save_image(result, output)
+    else:
+        with open(output, "wb") as file:
+            file.write(result)
+
+    return {"source": source, "output": output}
+
+def _scan(task: Tuple) -> dict:
+    source, _, _, options = task
+    ranking = scan_stencil_keys(**image_arg(source))[:options["top"]]
+
+    return {"source": source, "keys": [{"code": code, "count": count, "score": score} for code, count, score in ranking]}
+
+COMMANDS = {"encode": _encode, "decode": _decode, "scan": _scan}
+
+def _run_task(command: str, task: Tuple) -> dict:
+    """
+    Runs one task, returning the error in the record instead of raising it.
+    """
+
+    try:
+        return COMMANDS[command](task)
+    except Exception as e:
+        return {"source": task[0], "error": str(e)}
+
+def run_tasks(command: str, tasks: Iterable[Tuple], jobs: int) -> Iterator[dict]:
+    """
+    Yields the record of every task as it finishes, with at most 2*jobs tasks in flight,
+    so a run over millions of images does not queue them all at once.
+    """
+
+    if (jobs <= 1):
+        for task in tasks:
+            yield _run_task(command, task)
+        return
+
+    tasks = iter(tasks)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = set()
+
+        for task in tasks:
+            running.add(pool.submit(_run_task, command, task))
+
+            if (len(running) >= 2*jobs):
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+
+        for future in running:
+            yield future.result()
+
+class Progress:
+    """
+    Reports done, failed and remaining counts with the rate and ETA to stderr, at most every interval seconds.
+    """
+
+    def __init__(self, total: int, skipped: int=0, interval: float=0.5, enabled: bool=True):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.enabled = enabled
+        self.done = 0
+        self.failed = 0
+        self.start = self.last = time.monotonic()
+
+    def update(self, record: dict) -> None:
+        self.done += 1
+        self.failed += "error" in record
+
+        now = time.monotonic()
+
+        if (now-self.last >= self.interval or self.done == self.total):
+            self.last = now
+            self.report(now)
+
+    def report(self, now: float) -> None:
+        if (not self.enabled):
+            return
+
+        rate = self.done / max(now-self.start, 1e-9)
+        eta = (self.total-self.done) / rate if rate else 0
+        print(f"\r{self.done}/{self.total} done, {self.failed} failed, {self.skipped} skipped, {rate:.1f}/s, ETA {eta:.0f}s",
+              end="\n" if self.done == self.total else "", file=sys.stderr, flush=True)
+
+def parse_args(argv: List[str]=None):
+    parser = ArgumentParser(prog="stegimage", description="Encode, decode and scan images in bulk.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(command, manifest_help):
+        command.add_argument("inputs", nargs="+", help="image files, globs (quoted, ** allowed) or directories")
+        command.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: number of CPUs)")
+        command.add_argument("--manifest", help=manifest_help)
+        command.add_argument("--retry-errors", action="store_true", help="rerun images that failed in a previous run")
+        command.add_argument("-q", "--quiet", action="store_true", help="do not report progress")
+
+    encode = commands.add_parser("encode", help="encode text into images")
+    add_common(encode, "JSONL file recording the key of each image, used to resume (default: OUTPUT_DIR/manifest.jsonl)")
+    encode.add_argument("-o", "--output-dir", required=True, help="directory the encoded PNGs are written to")
+    encode.add_argument("-m", "--method", choices=["text", "stencil"], default="text")
+    text = encode.add_mutually_exclusive_group(required=True)
+    text.add_argument("-t", "--text", help="text to encode")
+    text.add_argument("--text-file", help="file holding the text to encode")
+    encode.add_argument("--bits", type=int, default=1, help="text: lower order bits used per channel")
+    encode.add_argument("--channels", default="G", help="text: channels used, any subset of RGB")
+    encode.add_argument("--header", action="store_true", help="text: embed a header so images decode without a key")
+    encode.add_argument("--ecc", action="store_true", help="text: add Hamming(7,4) error correction")
+    encode.add_argument("--compression", choices=list(CODECS), help="text: compress the text first, skipped if it does not get smaller")
+    encode.add_argument("--compression-level", type=int, choices=range(1, 10), help="text: compression level, 1 is fastest")
+    encode.add_argument("--text-size", type=int, default=50, help="stencil: text size in pixels")
+    encode.add_argument("--text-coords", type=int, nargs=2, default=(0, 0), metavar=("X", "Y"), help="stencil: text position")
+    encode.add_argument("--format", choices=["png", "tiff", "bmp", "npy"], default="png", help="output format, all but png are uncompressed")
+    encode.add_argument("--compress-level", type=int, choices=range(10), default=6, help="png: zlib level, 0 is fastest")
+    encode.add_argument("--strategy", choices=list(PNG_STRATEGIES), default="default", help="png: zlib strategy")
+
+    decode = commands.add_parser("decode", help="decode text or stencils from images")
+    add_common(decode, "JSONL file recording each decoded image, used to resume (default: OUTPUT_DIR/manifest.jsonl)")
+    decode.add_argument("-o", "--output-dir", required=True, help="directory the decoded text (.txt) or stencils (.png) are written to")
+    decode.add_argument("-m", "--method", choices=["text", "stencil"], default="text")
+    decode.add_argument("-k", "--key", type=int, help="key for all images, not needed for text encoded with --header")
+    decode.add_argument("--keys", help="manifest of an encode run to read the key of each image from")
+
+    scan = commands.add_parser("scan", help="rank the likely stencil keys of images")
+    add_common(scan, "JSONL file the results are written to, used to resume (default: standard output)")
+    scan.add_argument("--top", type=int, default=3, help="number of keys reported per image")
+
+    return parser.parse_args(argv)
+
+def build_tasks(args, done: dict) -> Tuple[List[Tuple], int]:
+    """
+    Returns the (source, output, key, options) tasks not recorded as done, and the number skipped.
+    """
+
+    if (args.command == "encode"):
+        if (args.text_file is not None):
+            with open(args.text_file, encoding="utf-8") as file:
+                args.text = file.read()
+
+        options = {"method": args.method, "text": args.text, "bits": args.bits, "channels": args.channels,
+                   "header": args.header, "ecc": args.ecc, "compression": args.compression, "compression_level": args.compression_level,
+                   "text_size": args.text_size, "text_coords": tuple(args.text_coords),
+                   "compress_level": args.compress_level, "strategy": args.strategy}
+        extension = "." + args.format
+    elif (args.command == "decode"):
+        # keys of an encode run are looked up by the path of the encoded image
+        keys = {os.path.normpath(record["output"]): text_key(record) for record in read_manifest(args.keys).values() if "key" in record}
+        options = {"method": args.method}
+        extension = ".png" if args.method == "stencil" else ".txt"
+    else:
+        options = {"top": args.top}
+        extension = ""
+
+    output_dir = getattr(args, "output_dir", None)
+    tasks, skipped, sources = [], 0, {}
+
+    for source, name in expand_inputs(args.inputs):
+        output = output_path(output_dir, name, extension) if output_dir else None
+
+        # inputs given separately can still share a name, and their outputs would overwrite each other
+        if (output is not None):
+            if (sources.get(output, source) != source):
+                raise ValueError(f"{sources[output]} AND {source} WOULD BOTH BE WRITTEN TO {output}")
+            elif (output in sources):
+                continue
+
+            sources[output] = source
+
+        record = done.get(source)
+
+        if (record is not None and (not args.retry_errors or "error" not in record)):
+            skipped += 1
+            continue
+
+        key = keys.get(os.path.normpath(source), args.key) if args.command == "decode" else None
+        tasks.append((source, output, key, options))
+
+    return tasks, skipped
+
+def main(argv: List[str]=None) -> int:
+    """
+    Runs the stegimage command line tool, returning 1 if any image failed.
+
+    Every finished image is appended to the manifest right away, so an interrupted run
+    started again with the same arguments skips the images already done.
+    """
+
+    args = parse_args(argv)
+
+    manifest = args.manifest
+    if (manifest is None and args.command != "scan"):
+        manifest = os.path.join(args.output_dir, "manifest.jsonl")
+
+    try:
+        tasks, skipped = build_tasks(args, read_manifest(manifest))
+    except ValueError as e:
+        print(f"stegimage: error: {e}", file=sys.stderr)
+        return 2
+
+    progress = Progress(len(tasks), skipped, enabled=not args.quiet)
+
+    if (manifest is not None):
+        os.makedirs(os.path.dirname(manifest) or ".", exist_ok=True)
+        out = open(manifest, "a")
+    else:
+        out = sys.stdout
+
+    try:
+        for record in run_tasks(args.command, tasks, args.jobs):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            progress.update(record)
+    finally:
+        if (out is not sys.stdout):
+            out.close()
+
+    return 1 if progress.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import bz2
+import lzma
+import zlib
+
+# codecs the payload can be compressed with, and their default levels
+CODECS = {"zlib": 6, "lzma": 6, "bz2": 9}
+
+# payloads inflate to at most this many times their compressed length by default, or 1 MiB if that is more
+MAX_RATIO = 64
+MIN_MAX_SIZE = 1 << 20
+
+def check_compression(codec: str, level: int=None) -> int:
+    """
+    Validates the codec and compression level, returning the level with the codec's default filled in.
+    """
+
+    if (codec not in CODECS):
+        raise ValueError("COMPRESSION MUST BE ONE OF zlib, lzma OR bz2")
+
+    if (level is None):
+        return CODECS[codec]
+    elif (level not in range(1, 10)):
+        raise ValueError("COMPRESSION LEVEL MUST BE BETWEEN 1 AND 9")
+
+    return level
+
+def compressor(codec: str, level: int):
+    """
+    Returns an incremental compressor with compress and flush methods.
+    """
+
+    if (codec == "zlib"):
+        return zlib.compressobj(level)
+    elif (codec == "lzma"):
+        return lzma.LZMACompressor(preset=level)
+
+    return bz2.BZ2Compressor(level)
+
+def decompressor(codec: str):
+    """
+    Returns an incremental decompressor for inflate.
+    """
+
+    if (codec == "zlib"):
+        return zlib.decompressobj()
+    elif (codec == "lzma"):
+        return lzma.LZMADecompressor()
+
+    return bz2.BZ2Decompressor()
+
+def compress(data, codec: str, level: int) -> bytes:
+    """
+    Compresses a bytes-like object in one call.
+    """
+
+    packer = compressor(codec, level)
+
+    return packer.compress(data) + packer.flush()
+
+def default_max_size(length: int) -> int:
+    """
+    Returns the default limit on the decompressed size of a payload of length compressed bytes.
+    """
+
+    return max(MAX_RATIO*length, MIN_MAX_SIZE)
+
+def inflate(unpacker, data, final: bool=True, max_size: int=-1) -> bytes:
+    """
+    Feeds data to a decompressor, checking the compressed stream ends with the final chunk.
+    Raises once data inflates to more than max_size bytes (-1 for no limit), without producing the rest.
+    """
+
+    try:
+        # one byte more than allowed is enough to tell the limit is exceeded
+        out = unpacker.decompress(data) if max_size < 0 else unpacker.decompress(data, max_size+1)
+    except (zlib.error, lzma.LZMAError, OSError, EOFError):
+        raise ValueError("INVALID COMPRESSED PAYLOAD") from None
+
+    if (max_size >= 0 and len(out) > max_size):
+        raise ValueError("DECOMPRESSED PAYLOAD EXCEEDS MAX SIZE")
+    elif (final and not unpacker.eof):
+        raise ValueError("INVALID COMPRESSED PAYLOAD")
+
+    return out
+
+def decompress(data, codec: str, max_size: int=-1) -> bytes:
+    """
+    Decompresses a bytes-like object in one call, raising if it inflates to more than max_size bytes (-1 for no limit).
+    """
+
+    return inflate(decompressor(codec), data, max_size=max_size)
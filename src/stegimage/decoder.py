@@ -1,82 +1,505 @@
+import codecs
 import numpy as np
-from PIL import Image
+import zlib
+from PIL import Image, ImageSequence
+from typing import Iterator, Union, Tuple
 
-from .helper import is_encoded_pixel, get_encrypted_bit, bin2str
+from .timing import stage
+from .header import Header, unpack_header, HEADER_SIZE, HEADER_PIXELS, FLAG_SCATTERED, FLAG_ECC, FLAG_COMPRESSION, COMPRESSION_FLAGS
+from .ecc import ecc_decode, BITS_PER_BYTE
+from .compression import check_compression, decompressor, decompress, inflate, default_max_size
+from .parallel import check_workers, match_stencil_sharded
+from .helper import pixel_codes, mask2rle, img2arr, check_array, load_image, image_size, as_output, extract_bits, bits2bytes, open_rows, check_embedding, pixels_needed, scatter_index, TextKey
 
-def decode_text(key: int, img_path: str=None, img: Image.Image=None) -> str:
+def decode_text(key: int=None, img_path: str=None, img: Union[Image.Image, np.ndarray]=None, bits: int=None, channels: str=None, seed: int=None, ecc: bool=None, compression: str=None, max_size: int=None) -> str:
     """
     Decodes image for encrypted text.
 
     Args:
-        key (int): The key used for decoding the image.
+        key (int, optional): The key used for decoding the image. May be omitted if the text was encoded with a header. Defaults to None.
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (PIL.Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+        bits (int, optional): The number of lower order bits used in each channel. Defaults to the setting carried by key, or 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to the setting carried by key, or "G".
+        seed (int, optional): The seed the payload was scattered with, if any. Defaults to None.
+        ecc (bool, optional): Whether the payload was Hamming(7,4) coded. Defaults to the setting carried by key, or False.
+        compression (str, optional): The codec the payload was compressed with, "zlib", "lzma" or "bz2". Defaults to the setting carried by key, or None.
+        max_size (int, optional): The most bytes a compressed payload may inflate to, guarding against decompression bombs.
+            Defaults to 64 times the compressed length, or 1 MiB if that is more.
+
+    Returns:
+        str: The decoded text from the image. Invalid UTF-8 sequences are replaced with U+FFFD.
+
+    Raises:
+        ValueError: If neither img_path nor img argument is provided.
+        ValueError: If the embedding or compression settings are invalid.
+        ValueError: If the key requires more pixels than the image has.
+        ValueError: If a header is expected but the image does not contain one, or the text does not match its checksum.
+        ValueError: If the header marks the payload as scattered and no seed is given.
+        ValueError: If the payload is not valid compressed data, or inflates to more than max_size bytes.
+
+    """
+
+    return decode_bytes(key, img_path=img_path, img=img, bits=bits, channels=channels, seed=seed, ecc=ecc, compression=compression, max_size=max_size).decode("utf-8", errors="replace")
+
+def decode_bytes(key: int=None, img_path: str=None, img: Union[Image.Image, np.ndarray]=None, bits: int=None, channels: str=None, seed: int=None, ecc: bool=None, compression: str=None, max_size: int=None) -> bytes:
+    """
+    Decodes image for encrypted binary data.
+
+    Args:
+        key (int, optional): The key used for decoding the image. May be omitted if the data was encoded with a header. Defaults to None.
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (PIL.Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+        bits (int, optional): The number of lower order bits used in each channel. Defaults to the setting carried by key, or 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to the setting carried by key, or "G".
+        seed (int, optional): The seed the payload was scattered with, if any. Defaults to None.
+        ecc (bool, optional): Whether the payload was Hamming(7,4) coded. Defaults to the setting carried by key, or False.
+        compression (str, optional): The codec the payload was compressed with, "zlib", "lzma" or "bz2". Defaults to the setting carried by key, or None.
+        max_size (int, optional): The most bytes a compressed payload may inflate to, guarding against decompression bombs.
+            Defaults to 64 times the compressed length, or 1 MiB if that is more.
+
+    Returns:
+        bytes: The decoded data from the image.
+
+    Raises:
+        ValueError: If neither img_path nor img argument is provided.
+        ValueError: If the embedding or compression settings are invalid.
+        ValueError: If the key requires more pixels than the image has.
+        ValueError: If a header is expected but the image does not contain one, or the data does not match its checksum.
+        ValueError: If the header marks the payload as scattered and no seed is given.
+        ValueError: If the payload is not valid compressed data, or inflates to more than max_size bytes.
+
+    Note:
+        - If key is omitted or was returned with header=True, the length and settings are read from the header, ignoring bits, channels, ecc and compression.
+          seed is then only used if the header marks the payload as scattered.
+
+    """
+
+    arr, key, start, crc = _payload_rows(key, img_path, img, bits, channels, seed, ecc, compression)
+
+    # read all encoded bits in one pass over the pixel array
+    data = _read_bytes(arr, key, key, start)
+
+    if (crc is not None and zlib.crc32(data) != crc):
+        raise ValueError("PAYLOAD CHECKSUM MISMATCH")
+
+    if (key.compression is not None):
+        with stage("decompress"):
+            data = decompress(data, key.compression, default_max_size(key) if max_size is None else max_size)
+
+    return data
+
+def decode_stream(key: int=None, img_path: str=None, img: Union[Image.Image, np.ndarray]=None, bits: int=None, channels: str=None, chunk_size: int=65536, encoding: str=None, seed: int=None, ecc: bool=None, compression: str=None, max_size: int=None) -> Iterator:
+    """
+    Decodes image for encrypted data, yielding it chunk by chunk.
+
+    Args:
+        key (int, optional): The key used for decoding the image. May be omitted if the data was encoded with a header. Defaults to None.
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (PIL.Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+        bits (int, optional): The number of lower order bits used in each channel. Defaults to the setting carried by key, or 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to the setting carried by key, or "G".
+        seed (int, optional): The seed the payload was scattered with, if any. Defaults to None.
+        ecc (bool, optional): Whether the payload was Hamming(7,4) coded. Defaults to the setting carried by key, or False.
+        compression (str, optional): The codec the payload was compressed with, "zlib", "lzma" or "bz2". Defaults to the setting carried by key, or None.
+        max_size (int, optional): The most bytes a compressed payload may inflate to, guarding against decompression bombs.
+            Defaults to 64 times the compressed length, or 1 MiB if that is more.
+        chunk_size (int, optional): The number of bytes decoded at a time. Defaults to 65536.
+            With compression, this is the number of compressed bytes, and chunks are yielded as they are inflated.
+        encoding (str, optional): If given, chunks are decoded to str with this encoding, e.g. "utf-8". Defaults to None.
+
+    Yields:
+        bytes | str: Consecutive chunks of the decoded data.
+
+    Raises:
+        ValueError: If neither img_path nor img argument is provided.
+        ValueError: If the embedding or compression settings are invalid.
+        ValueError: If the key requires more pixels than the image has.
+        ValueError: If a header is expected but the image does not contain one, or the data does not match its checksum.
+        ValueError: If the header marks the payload as scattered and no seed is given.
+        ValueError: If the payload is not valid compressed data, or inflates to more than max_size bytes.
+            The checksum is verified once the last chunk has been decoded.
+
+    Example:
+        with open("payload.bin", "wb") as f:
+            for chunk in decode_stream(key, img_path="encoded_image.png"):
+                f.write(chunk)
+    """
+
+    arr, key, start, crc = _payload_rows(key, img_path, img, bits, channels, seed, ecc, compression)
+    checksum = 0
+
+    if (encoding is not None):
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    if (key.compression is not None):
+        unpacker = decompressor(key.compression)
+        remaining = default_max_size(key) if max_size is None else max_size
+
+    for offset in range(0, key, chunk_size):
+        count = min(chunk_size, key-offset)
+
+        chunk = _read_bytes(arr, key, count, start+offset*_bits_per_byte(key))
+
+        if (crc is not None):
+            checksum = zlib.crc32(chunk, checksum)
+
+            if (offset+count == key and checksum != crc):
+                raise ValueError("PAYLOAD CHECKSUM MISMATCH")
+
+        if (key.compression is not None):
+            with stage("decompress"):
+                chunk = inflate(unpacker, chunk, final=offset+count == key, max_size=remaining)
+                remaining -= len(chunk)
+
+        if (encoding is not None):
+            chunk = decoder.decode(chunk, final=offset+count == key)
+
+        yield chunk
+
+def decode_frames(key: int=None, img_path: str=None, img: Image.Image=None, bits: int=None, channels: str=None, encoding: str=None) -> Union[bytes, str]:
+    """
+    Decodes data spread across the frames of a multi-frame image by encode_frames, one frame at a time.
+
+    Args:
+        key (int, optional): The key returned by encode_frames. May be omitted if the data was encoded with a header. Defaults to None.
         img_path (str, optional): The path to the image file. Defaults to None.
         img (PIL.Image.Image, optional): The image object. Defaults to None.
+        bits (int, optional): The number of lower order bits used in each channel. Defaults to the setting carried by key, or 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to the setting carried by key, or "G".
+        encoding (str, optional): If given, the data is decoded to str with this encoding, e.g. "utf-8". Defaults to None.
 
     Returns:
-        str: The decoded text from the image.
+        bytes | str: The decoded data.
 
     Raises:
         ValueError: If neither img_path nor img argument is provided.
+        ValueError: If the embedding settings are invalid.
+        ValueError: If the key requires more pixels than the frames have.
+        ValueError: If a header is expected but the first frame does not contain one, or the data does not match its checksum.
 
+    Note:
+        - Only one frame is decoded at a time, and only the rows of it holding the payload.
     """
 
-    # checks if atleast one image argument is provided
-    if (img_path == None and img == None):
+    if (img_path is None and img is None):
         raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
-    
-    if (img_path != None and img == None):
-        img = Image.open(img_path).convert("RGB")
+
+    if (img is None):
+        img = Image.open(img_path)
+
+    header = key is None or getattr(key, "header", False)
+
+    if (header):
+        img.seek(0)
+        first = img2arr(img.crop((0, 0, img.size[0], -(-HEADER_PIXELS // img.size[0]))))
+
+        with stage("extract", HEADER_PIXELS):
+            parsed = unpack_header(bits2bytes(extract_bits(first, HEADER_SIZE*8)))
+
+        key, bits, channels, crc = parsed.length, parsed.bits, parsed.channels, parsed.crc
+    else:
+        # settings recorded in the key by encode_frames, unless given explicitly
+        if (bits is None):
+            bits = getattr(key, "bits", 1)
+        if (channels is None):
+            channels = getattr(key, "channels", "G")
+
+        crc = None
+
+    bits, channels = check_embedding(bits, channels)
+    remaining = key*8
+    chunks = []
+
+    # bits of one frame that do not fill a whole byte are carried over to the next frame
+    carry = np.zeros(0, dtype=np.uint8)
+
+    for i, frame in enumerate(ImageSequence.Iterator(img)):
+        if (remaining == 0):
+            break
+
+        length, height = frame.size
+        offset = HEADER_PIXELS if (header and i == 0) else 0
+        count = min(remaining, max(length*height - offset, 0)*len(channels)*bits)
+
+        # only the rows of the frame holding its share of the payload are converted
+        rows = -(-(offset + -(-count // (bits*len(channels)))) // length)
+        arr = img2arr(frame.crop((0, 0, length, rows)))
+
+        with stage("extract", -(-count // (bits*len(channels)))):
+            frame_bits = np.concatenate((carry, extract_bits(arr, count, bits, channels, start=offset*len(channels)*bits)))
+
+        aligned = len(frame_bits) - len(frame_bits)%8
+        chunks.append(bits2bytes(frame_bits[:aligned]))
+        carry = frame_bits[aligned:]
+        remaining -= count
+
+    if (remaining > 0):
+        raise ValueError("KEY EXCEEDS IMAGE CAPACITY")
+
+    data = b"".join(chunks)
+
+    if (crc is not None and zlib.crc32(data) != crc):
+        raise ValueError("PAYLOAD CHECKSUM MISMATCH")
+
+    return data.decode(encoding, errors="replace") if encoding is not None else data
+
+def read_header(img_path: str=None, img: Union[Image.Image, np.ndarray]=None) -> Header:
+    """
+    Reads the header embedded by the encoders with header=True.
+
+    Args:
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (PIL.Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+
+    Returns:
+        Header: The length, embedding settings, CRC32 and flags of the payload.
+
+    Raises:
+        ValueError: If neither img_path nor img argument is provided.
+        ValueError: If the image does not contain a header.
+
+    Note:
+        - Only the first 128 pixels are read, so images without a payload are rejected without decoding the rest.
+    """
+
+    if (img_path is None and img is None):
+        raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
+
+    arr = _load_pixels(img_path, img, HEADER_PIXELS, "IMAGE DOES NOT CONTAIN A HEADER")
+
+    with stage("extract", HEADER_PIXELS):
+        return unpack_header(bits2bytes(extract_bits(arr, HEADER_SIZE*8)))
+
+def _load_pixels(img_path: str, img, num_pixels: int, error: str) -> np.ndarray:
+    """
+    Loads the rows of the image holding the first num_pixels pixels (row-major) as an RGB array.
+    Arrays are sliced without copying.
+    """
+
+    # only the size is read here, pixels are decoded below
+    length, height = image_size(img_path, img)
+
+    if (num_pixels > length*height):
+        raise ValueError(error)
+
+    # only the rows holding the first num_pixels pixels are decoded and converted
+    rows = -(-num_pixels // length)
+
+    # an empty payload needs no pixels, and a PNG cannot be cut to zero rows
+    if (rows == 0):
+        return np.zeros((0, length, 3), dtype=np.uint8)
+    elif (isinstance(img, np.ndarray)):
+        return img[:rows]
+    elif (img is None):
+        img = open_rows(img_path, rows)
     else:
         # default to using img argument
-        img = img.convert("RGB")
+        img = img.crop((0, 0, length, rows))
 
-    length, height = img.getbbox()[2]-img.getbbox()[0], img.getbbox()[3]-img.getbbox()[1]
-    curr = (0, 0)
+    return img2arr(img)
 
-    lsb_list = []
+def _bits_per_byte(key: TextKey) -> int:
+    return BITS_PER_BYTE if key.ecc else 8
 
-    for x in range(key*8):
-        pxl = img.getpixel(curr)
-        lsb_list += [get_encrypted_bit(pxl)]
+def _read_bytes(arr: np.ndarray, key: TextKey, count: int, start: int) -> bytes:
+    """
+    Reads count payload bytes from bit position start, correcting errors if the key has ecc set.
+    """
 
-        curr = (curr[0]+1, curr[1])
+    with stage("extract", pixels_needed(count, key.bits, key.channels, _bits_per_byte(key))):
+        bits = extract_bits(arr, count*_bits_per_byte(key), key.bits, key.channels, start=start)
 
-        if (curr[0] == length):
-            curr = (0, curr[1]+1)
+    if (not key.ecc):
+        return bits2bytes(bits)
 
-    return bin2str(lsb_list)
+    with stage("correct", count):
+        return ecc_decode(bits)
 
-def decode_stencil(key: int, img_path: str=None, img: Image.Image=None) -> Image.Image:
+def _payload_rows(key: int, img_path: str, img, bits: int, channels: str, seed: int=None, ecc: bool=None, compression: str=None) -> Tuple:
+    """
+    Loads the rows of the image holding the payload as an RGB array, or with seed, the scattered payload pixels in order.
+    Also returns the key carrying the resolved embedding settings, the bit position the payload
+    starts at and its CRC32 (None without a header).
+    """
+
+    # checks if atleast one image argument is provided
+    if (img_path is None and img is None):
+        raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
+
+    if (key is None or getattr(key, "header", False)):
+        header = read_header(img_path=img_path, img=img)
+        key = TextKey(header.length, header.bits, header.channels, header=True)
+        bits, channels, offset, crc = header.bits, header.channels, HEADER_PIXELS, header.crc
+
+        ecc = bool(header.flags & FLAG_ECC)
+        compression = next((codec for codec, flag in COMPRESSION_FLAGS.items() if header.flags & FLAG_COMPRESSION == flag), None)
+
+        if (not header.flags & FLAG_SCATTERED):
+            seed = None
+        elif (seed is None):
+            raise ValueError("SEED REQUIRED FOR SCATTERED PAYLOAD")
+    else:
+        # settings recorded in the key by encode_bytes, unless given explicitly
+        if (bits is None):
+            bits = getattr(key, "bits", 1)
+        if (channels is None):
+            channels = getattr(key, "channels", "G")
+        if (ecc is None):
+            ecc = getattr(key, "ecc", False)
+        if (compression is None):
+            compression = getattr(key, "compression", None)
+
+        offset, crc = 0, None
+
+    bits, channels = check_embedding(bits, channels)
+    num_pixels = offset + pixels_needed(key, bits, channels, BITS_PER_BYTE if ecc else 8)
+
+    if (compression is not None):
+        check_compression(compression)
+    start = offset*len(channels)*bits
+
+    if (seed is not None):
+        shape = image_size(img_path, img)[::-1]
+
+        if (num_pixels > shape[0]*shape[1]):
+            raise ValueError("KEY EXCEEDS IMAGE CAPACITY")
+
+        # only the rows up to the last scattered pixel are loaded, then the payload pixels are gathered
+        index = scatter_index(seed, shape, offset, num_pixels-offset)
+        arr = _load_pixels(img_path, img, int(index.max(initial=offset))+1, "KEY EXCEEDS IMAGE CAPACITY")
+        arr, start = arr.reshape(-1, 3)[index], 0
+    else:
+        arr = _load_pixels(img_path, img, num_pixels, "KEY EXCEEDS IMAGE CAPACITY")
+
+    return arr, TextKey(key, bits, channels, crc is not None, ecc, compression), start, crc
+
+def decode_stencil(key: int, img_path: str=None, img: Union[Image.Image, np.ndarray]=None, output: str="image", inplace: bool=False, workers: int=1) -> Union[Image.Image, np.ndarray, Tuple]:
     """
     Decodes image for encrypted stencil.
 
     Args:
         key (int): The encryption key used to decode the image.
         img_path (str, optional): The path to the image file. Defaults to None.
-        img (PIL.Image.Image, optional): The image object. Defaults to None.
+        img (PIL.Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+        output (str, optional): The form of the result, one of "image", "mask" or "rle". Defaults to "image".
+        inplace (bool, optional): Whether to mark the encrypted pixels in the img array itself instead of a copy. Defaults to False.
+        workers (int, optional): The number of threads matching bands of the image rows in parallel, None for one per CPU.
+            Only pays off for images of millions of pixels. Defaults to 1.
 
     Returns:
-        PIL.Image.Image: The decoded image with encrypted pixels set to green.
+        PIL.Image.Image | np.ndarray: For "image", the decoded image with encrypted pixels set to green,
+            as an array if img is an array.
+        np.ndarray: For "mask", a boolean (height, length) array marking the encrypted pixels.
+        tuple: For "rle", the bounding box (x0, y0, x1, y1) of the encrypted pixels (None if there are none)
+            and the run lengths of the mask inside it (see helper.mask2rle).
     
     Raises:
         ValueError: If neither `img_path` nor `img` is provided.
+        ValueError: If `output` is not a supported form.
+        ValueError: If `img` is an array that is not HxWx3 uint8, or `inplace` is set without a writable, C-contiguous array.
+        ValueError: If `workers` is less than 1.
     """
 
-    if (img_path == None and img == None):
+    if (img_path is None and img is None):
         raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
-    
-    if (img_path != None and img == None):
-        img = Image.open(img_path).convert("RGB")
+
+    if (output not in ("image", "mask", "rle")):
+        raise ValueError("OUTPUT MUST BE ONE OF image, mask OR rle")
+
+    workers = check_workers(workers)
+
+    if (output != "image" and isinstance(img, np.ndarray)):
+        # the array is only read, so it is not copied
+        arr = check_array(img)
     else:
-        # default to using img argument
-        img = img.convert("RGB")
+        # defaults to using img argument, converted once to an RGB array
+        arr = load_image(img_path, img, inplace)
+
+    # for "image", each band of rows also sets its decrypted pixels to green
+    with stage("match", arr.shape[0]*arr.shape[1]):
+        mask = match_stencil_sharded(arr, key, workers, paint=output == "image")
+
+    if (output == "mask"):
+        return mask
+    elif (output == "rle"):
+        return mask2rle(mask)
+
+    return as_output(arr, img)
+
+def _pair_counts(codes: np.ndarray, next_codes: np.ndarray=None, pixels: np.ndarray=None) -> Tuple:
+    """
+    Counts the horizontal and vertical neighbor pairs scored for each code, and those sharing the code.
+    With pixels, only pairs of those pixels are scored, and with next_codes, only pairs differing in their next 2 bits.
+    """
+
+    pairs = np.zeros(64, dtype=np.int64)
+    shared = np.zeros(64, dtype=np.int64)
+
+    for first, second in [(np.s_[:, :-1], np.s_[:, 1:]), (np.s_[:-1, :], np.s_[1:, :])]:
+        scored = np.ones(codes[first].shape, dtype=bool) if pixels is None else pixels[first] & pixels[second]
+
+        if (next_codes is not None):
+            scored &= next_codes[first] != next_codes[second]
+
+        same = scored & (codes[first] == codes[second])
+        pairs += np.bincount(codes[first][scored], minlength=64)
+        shared += np.bincount(codes[first][same], minlength=64)
+
+    return pairs, shared
+
+def scan_stencil_keys(img_path: str=None, img: Union[Image.Image, np.ndarray]=None) -> list:
+    """
+    Scans image for the stencil keys it may be encoded with, in a single pass.
+
+    Args:
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (PIL.Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+
+    Returns:
+        list: A (code, count, score) tuple for each of the 64 effective keys (key%64), ranked by score.
+            count is the number of pixels holding the code and score is how much more often neighboring
+            pixels share the code than its frequency would give, so a stencil shows up as the highest score.
+    
+    Raises:
+        ValueError: If neither `img_path` nor `img` is provided.
+
+    Note:
+        - Only pairs of pixels with unusual codes for their color, and differing in their next 2 bits, are scored.
+          This leaves out codes shared because of palettes, flat areas or smooth gradients.
+        - When no such pair exists, as for a stencil on a flat background, the pairs of unusual pixels are scored
+          regardless of their next 2 bits, and failing that all pairs of pixels.
+        - Any code can be passed as the key to decode_stencil.
+    """
+
+    if (img_path is None and img is None):
+        raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
+
+    # arrays are only read, so they are not copied
+    arr = check_array(img) if isinstance(img, np.ndarray) else load_image(img_path, img)
+    codes = pixel_codes(arr)
+    counts = np.bincount(codes.ravel(), minlength=64)
+
+    # a stencil sets the code of its pixels without touching the next 2 bits
+    next_codes = pixel_codes(arr >> 2)
+
+    # a pixel is a candidate if less than half of the pixels with its upper 6 bits share its code
+    colors = (arr[..., 0].astype(np.uint32) << 16) | (arr[..., 1].astype(np.uint32) << 8) | arr[..., 2]
+    upper = ((colors >> 18) << 12) | (((colors >> 10) & 0x3F) << 6) | ((colors >> 2) & 0x3F)
+    _, inverse, color_counts = np.unique(colors.ravel(), return_inverse=True, return_counts=True)
+    upper_counts = np.bincount(upper.ravel(), minlength=1 << 18)
+    candidates = color_counts[inverse].reshape(codes.shape) < upper_counts[upper] / 2
+
+    # on flat areas the next 2 bits never differ, then candidates are scored on their own, then all pixels
+    for pixels, check_next in [(candidates, True), (candidates, False), (None, False)]:
+        pairs, shared = _pair_counts(codes, next_codes if check_next else None, pixels)
+
+        if (pairs.any()):
+            break
 
-    length, height = img.getbbox()[2]-img.getbbox()[0], img.getbbox()[3]-img.getbbox()[1]
+    # share rate of each code relative to its frequency, the rate expected by chance
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.nan_to_num((shared / pairs) / (counts / codes.size))
 
-    for y in range(height):
-        for x in range(length):
-            if (is_encoded_pixel(img.getpixel((x, y)), key)):
-                # sets decrypted pixels to green
-                img.putpixel((x, y), (0, 255, 0))
+    ranking = np.argsort(-scores, kind="stable")
 
-    return img
\ No newline at end of file
+    return [(int(c), int(counts[c]), float(scores[c])) for c in ranking]
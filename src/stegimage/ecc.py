@@ -0,0 +1,68 @@
+import numpy as np
+
+# each byte is sent as two Hamming(7,4) codewords, 14 bits
+BITS_PER_BYTE = 14
+
+# generator matrix of Hamming(7,4), codeword bits p1 p2 d1 p3 d2 d3 d4 from data bits d1 d2 d3 d4
+_GENERATOR = np.array([
+    [1, 1, 0, 1],
+    [1, 0, 1, 1],
+    [1, 0, 0, 0],
+    [0, 1, 1, 1],
+    [0, 1, 0, 0],
+    [0, 0, 1, 0],
+    [0, 0, 0, 1],
+], dtype=np.uint8)
+
+def _nibble_codewords() -> np.ndarray:
+    """
+    Returns the 7-bit codeword of each nibble.
+    """
+
+    data = np.unpackbits(np.arange(16, dtype=np.uint8)[:, None], axis=1)[:, 4:]
+    bits = (data @ _GENERATOR.T) % 2
+
+    return np.packbits(bits, axis=1, bitorder="big")[:, 0] >> 1
+
+def _nibble_decoder() -> np.ndarray:
+    """
+    Returns the nibble of each 7-bit word, correcting any single flipped bit.
+    """
+
+    codewords = _nibble_codewords()
+    table = np.zeros(128, dtype=np.uint8)
+
+    # every word is a codeword or one bit away from exactly one codeword
+    for nibble, codeword in enumerate(codewords):
+        table[codeword] = nibble
+
+        for bit in range(7):
+            table[codeword ^ (1 << bit)] = nibble
+
+    return table
+
+_NIBBLE_CODEWORDS = _nibble_codewords()
+
+# 14-bit codeword pair of each byte, and the corrected byte of each 14-bit word
+ENCODE_TABLE = ((_NIBBLE_CODEWORDS[np.arange(256) >> 4].astype(np.uint16) << 7) | _NIBBLE_CODEWORDS[np.arange(256) & 0xF]).astype(">u2")
+DECODE_TABLE = ((_nibble_decoder()[np.arange(16384) >> 7] << 4) | _nibble_decoder()[np.arange(16384) & 0x7F]).astype(np.uint8)
+
+def ecc_encode(data) -> np.ndarray:
+    """
+    Returns the bits of the Hamming(7,4) codewords of a bytes-like object, 14 per byte.
+    """
+
+    codes = ENCODE_TABLE[np.frombuffer(memoryview(data).cast("B"), dtype=np.uint8)]
+
+    # the 2 leading bits of each 16-bit code are always 0
+    return np.unpackbits(codes.view(np.uint8)).reshape(-1, 16)[:, 2:].reshape(-1)
+
+def ecc_decode(bits: np.ndarray) -> bytes:
+    """
+    Returns the bytes held in Hamming(7,4) codeword bits, correcting one flipped bit per 7-bit codeword.
+    """
+
+    words = np.zeros((len(bits) // BITS_PER_BYTE, 16), dtype=np.uint8)
+    words[:, 2:] = bits[:len(words)*BITS_PER_BYTE].reshape(-1, BITS_PER_BYTE)
+
+    return DECODE_TABLE[np.packbits(words).view(">u2")].tobytes()
@@ -1,98 +1,398 @@
-from PIL import Image, ImageFont
+import numpy as np
+import zlib
+import os
+from PIL import Image, ImageSequence, TiffImagePlugin
 from typing import Union, Tuple
-from .helper import encode_pixel, generate_key, make_text_img, str2bin, encode_lsb
+from .timing import stage
+from .header import Header, pack_header, HEADER_PIXELS, FLAG_SCATTERED, FLAG_ECC, COMPRESSION_FLAGS
+from .ecc import ecc_encode, BITS_PER_BYTE
+from .compression import check_compression, compressor, compress
+from .parallel import check_workers, embed_bits_sharded, embed_scattered_sharded, stamp_stencil_sharded
+from .helper import generate_key, text_mask, load_image, as_output, img2arr, bit_range, bytes2bits, embed_bits, check_embedding, pixels_needed, read_chunks, scatter_index, TextKey
 
-def encode_text(encoded_text: str, img_path: str=None, img: Image.Image=None) -> Tuple:
+def encode_text(encoded_text: str, img_path: str=None, img: Union[Image.Image, np.ndarray]=None, bits: int=1, channels: str="G", header: bool=False, inplace: bool=False, seed: int=None, ecc: bool=False, compression: str=None, compression_level: int=None, workers: int=1) -> Tuple:
     """
     Encodes the text into the image.
 
     Args:
         encoded_text (str): The text to be encoded into the image.
         img_path (str, optional): The path to the image file. Defaults to None.
-        img (Image.Image, optional): The image object. Defaults to None.
+        img (Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+        bits (int, optional): The number of lower order bits (1-4) used in each channel. Defaults to 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to "G".
+        header (bool, optional): Whether to embed a header with the length, settings and CRC32 of the text ahead of it. Defaults to False.
+        inplace (bool, optional): Whether to encode into the img array itself instead of a copy. Defaults to False.
+        seed (int, optional): If given, the payload is scattered over pseudorandom pixels chosen by seed instead of filling them in row-major order.
+            The same seed must be passed to the decoder. Defaults to None.
+        ecc (bool, optional): Whether to add Hamming(7,4) error correction, which corrects one flipped bit in every 7 embedded bits
+            at the cost of 14 embedded bits per byte instead of 8. Defaults to False.
+        compression (str, optional): If given, the data is compressed with "zlib", "lzma" or "bz2" before embedding,
+            and kept uncompressed if that does not make it smaller. Defaults to None.
+        compression_level (int, optional): The compression level, from 1 (fastest) to 9 (smallest). Defaults to the codec's default.
+        workers (int, optional): The number of threads embedding shards of the pixels in parallel, None for one per CPU.
+            Only pays off for payloads of millions of pixels. Defaults to 1.
 
     Returns:
-        tuple | ValueError: A tuple containing the encoded image (Image.Image) and the length of the encoded text (int).
+        tuple | ValueError: A tuple containing the encoded image (Image.Image, or np.ndarray if img is an array) and the key (TextKey), which is the length of the UTF-8 encoded text (int), or of the compressed text, carrying the embedding settings.
 
     Raises:
         ValueError: If neither img_path nor img is provided.
+        ValueError: If img is an array that is not HxWx3 uint8, or inplace is set without a writable, C-contiguous array.
+        ValueError: If the embedding or compression settings are invalid, or workers is less than 1.
         ValueError: If the text does not fit in the image.
 
     Note:
         - At least one image argument (img_path or img) must be provided.
         - The image should be in RGB format.
-        - The encoded text should fit within the image. If the length of the encoded text multiplied by 8 is greater than the number of pixels in the image, a ValueError is raised.
+        - The text is encoded as UTF-8 and embedded with encode_bytes.
+        - The encoded text should fit within the image. With the default settings, if the length of the encoded text multiplied by 8 is greater than the number of pixels in the image, a ValueError is raised.
+          With compression, the compressed length counts, so compressible text such as JSON or logs fits in proportionally fewer pixels.
         - The function uses the least significant bit (LSB) technique to encode the text into the image pixels.
 
     Example:
         encoded_image, text_length = encode_text("Hello, world!", img_path="image.png")
+        encoded_image, key = encode_text("Hello, world!", img_path="image.png", bits=2, channels="RGB")
     """
-    
+
+    return encode_bytes(encoded_text.encode("utf-8"), img_path=img_path, img=img, bits=bits, channels=channels, header=header, inplace=inplace, seed=seed, ecc=ecc,
+                        compression=compression, compression_level=compression_level, workers=workers)
+
+def encode_bytes(data, img_path: str=None, img: Union[Image.Image, np.ndarray]=None, bits: int=1, channels: str="G", header: bool=False, inplace: bool=False, seed: int=None, ecc: bool=False, compression: str=None, compression_level: int=None, workers: int=1) -> Tuple:
+    """
+    Encodes binary data into the image.
+
+    Args:
+        data (bytes-like): The data to be encoded into the image, e.g. bytes, bytearray, memoryview or a NumPy array.
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+        bits (int, optional): The number of lower order bits (1-4) used in each channel. Defaults to 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to "G".
+        header (bool, optional): Whether to embed a header with the length, settings and CRC32 of the data ahead of it. Defaults to False.
+        inplace (bool, optional): Whether to encode into the img array itself instead of a copy. Defaults to False.
+        seed (int, optional): If given, the payload is scattered over pseudorandom pixels chosen by seed instead of filling them in row-major order.
+            The same seed must be passed to the decoder. Defaults to None.
+        ecc (bool, optional): Whether to add Hamming(7,4) error correction, which corrects one flipped bit in every 7 embedded bits
+            at the cost of 14 embedded bits per byte instead of 8. Defaults to False.
+        compression (str, optional): If given, the data is compressed with "zlib", "lzma" or "bz2" before embedding,
+            and kept uncompressed if that does not make it smaller. Defaults to None.
+        compression_level (int, optional): The compression level, from 1 (fastest) to 9 (smallest). Defaults to the codec's default.
+        workers (int, optional): The number of threads embedding shards of the pixels in parallel, None for one per CPU.
+            Only pays off for payloads of millions of pixels. Defaults to 1.
+
+    Returns:
+        tuple | ValueError: A tuple containing the encoded image (Image.Image, or np.ndarray if img is an array) and the key (TextKey), which is the number of encoded bytes (int) carrying the embedding settings.
+
+    Raises:
+        ValueError: If neither img_path nor img is provided.
+        ValueError: If img is an array that is not HxWx3 uint8, or inplace is set without a writable, C-contiguous array.
+        ValueError: If the embedding or compression settings are invalid, or workers is less than 1.
+        ValueError: If the data does not fit in the image.
+
+    Note:
+        - The data is read through a memoryview and unpacked to bits in bulk.
+        - Bits are written into the channels of the pixels in row-major order as a single array operation. Each pixel holds bits*len(channels) bits.
+        - The header takes the green channel LSB of the first 128 pixels and lets decode_bytes run without a key.
+
+    Example:
+        encoded_image, key = encode_bytes(b"\x00\x01\x02", img_path="image.png")
+    """
+
+    workers = check_workers(workers)
+
+    if (compression is not None):
+        level = check_compression(compression, compression_level)
+        data = memoryview(data).cast("B")
+
+        with stage("compress"):
+            packed = compress(data, compression, level)
+
+        # compressing small or random data can make it larger, it is then embedded as is
+        if (len(packed) < len(data)):
+            data = packed
+        else:
+            compression = None
+
+    return _embed_chunks([data], img_path, img, bits, channels, header, inplace, seed, ecc, compression, workers)
+
+def encode_stream(stream, img_path: str=None, img: Union[Image.Image, np.ndarray]=None, bits: int=1, channels: str="G", header: bool=False, chunk_size: int=65536, inplace: bool=False, seed: int=None, ecc: bool=False, compression: str=None, compression_level: int=None, workers: int=1) -> Tuple:
+    """
+    Encodes a stream of data into the image chunk by chunk.
+
+    Args:
+        stream (file-like | Iterable): A file-like object with a read method, or an iterable of bytes-like or str chunks. Text is encoded as UTF-8.
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
+        bits (int, optional): The number of lower order bits (1-4) used in each channel. Defaults to 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to "G".
+        header (bool, optional): Whether to embed a header with the length, settings and CRC32 of the data ahead of it. Defaults to False.
+        chunk_size (int, optional): The number of bytes or characters read from a file-like stream at a time. Defaults to 65536.
+        inplace (bool, optional): Whether to encode into the img array itself instead of a copy. Defaults to False.
+        seed (int, optional): If given, the payload is scattered over pseudorandom pixels chosen by seed instead of filling them in row-major order.
+            The same seed must be passed to the decoder. Defaults to None.
+        ecc (bool, optional): Whether to add Hamming(7,4) error correction, which corrects one flipped bit in every 7 embedded bits
+            at the cost of 14 embedded bits per byte instead of 8. Defaults to False.
+        compression (str, optional): If given, the stream is compressed with "zlib", "lzma" or "bz2" as it is read. Defaults to None.
+        compression_level (int, optional): The compression level, from 1 (fastest) to 9 (smallest). Defaults to the codec's default.
+        workers (int, optional): The number of threads embedding shards of the pixels in parallel, None for one per CPU.
+            Only pays off for payloads of millions of pixels. Defaults to 1.
+
+    Returns:
+        tuple | ValueError: A tuple containing the encoded image (Image.Image, or np.ndarray if img is an array) and the key (TextKey), which is the number of encoded bytes (int) carrying the embedding settings.
+
+    Raises:
+        ValueError: If neither img_path nor img is provided.
+        ValueError: If img is an array that is not HxWx3 uint8, or inplace is set without a writable, C-contiguous array.
+        ValueError: If the embedding or compression settings are invalid, or workers is less than 1.
+        ValueError: If the data does not fit in the image.
+
+    Note:
+        - Only one chunk and its bits are held in memory at a time. The result is the same as encode_bytes on the concatenated chunks.
+          With seed, the pixels depend on the total length, so the chunks are collected and embedded at the end.
+        - The header is written once the whole stream has been embedded.
+        - With workers, each chunk is split across the threads, so large chunks parallelize best.
+        - With compression, the key is the number of compressed bytes. Unlike encode_bytes, the stream is
+          always compressed, as its size is not known before it has been embedded.
+
+    Example:
+        with open("payload.bin", "rb") as f:
+            encoded_image, key = encode_stream(f, img_path="image.png")
+    """
+
+    workers = check_workers(workers)
+    chunks = _byte_chunks(stream, chunk_size)
+
+    if (compression is not None):
+        chunks = _compress_chunks(chunks, compression, check_compression(compression, compression_level))
+
+    return _embed_chunks(chunks, img_path, img, bits, channels, header, inplace, seed, ecc, compression, workers)
+
+def _byte_chunks(stream, chunk_size: int):
+    """
+    Yields the chunks of a stream as bytes-like objects, encoding text as UTF-8.
+    """
+
+    for chunk in read_chunks(stream, chunk_size):
+        if (isinstance(chunk, str)):
+            chunk = chunk.encode("utf-8")
+
+        yield memoryview(chunk).cast("B")
+
+def _compress_chunks(chunks, codec: str, level: int):
+    """
+    Yields the compressed data of chunks as it is produced.
+    """
+
+    packer = compressor(codec, level)
+
+    for chunk in chunks:
+        with stage("compress"):
+            packed = packer.compress(chunk)
+
+        if (packed):
+            yield packed
+
+    with stage("compress"):
+        packed = packer.flush()
+
+    yield packed
+
+def _embed_chunks(chunks, img_path: str, img, bits: int, channels: str, header: bool, inplace: bool, seed: int, ecc: bool, compression: str, workers: int) -> Tuple:
+    """
+    Embeds bytes-like chunks one at a time, as described in encode_stream. compression only sets the header flag and key.
+    """
+
     # checks if at least one image argument is provided
-    if (img_path == None and img == None):
+    if (img_path is None and img is None):
         raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
-    
-    if (img_path != None and img == None):
-        img = Image.open(img_path).convert("RGB")
-    else:
-        # default to using img argument
-        img = img.convert("RGB")
 
-    length, height = img.getbbox()[2]-img.getbbox()[0], img.getbbox()[3]-img.getbbox()[1]
+    bits, channels = check_embedding(bits, channels)
+
+    # defaults to using img argument, converted once to an RGB array
+    arr = load_image(img_path, img, inplace)
+    height, length = arr.shape[:2]
     num_pixels = length * height
 
-    # checks if encoded_text can fit in the provided image
-    if (len(encoded_text)*8 > num_pixels):
-        raise ValueError("TEXT DOES NOT FIT IN IMAGE")
-    
-    # generate binary version of encoded_text
-    bin_encodings = str2bin(encoded_text)
+    # the payload starts after the pixels reserved for the header
+    offset = HEADER_PIXELS if header else 0
+
+    num_bytes = 0
+    written = offset*len(channels)*bits
+    crc = 0
+
+    # with error correction each byte is embedded as two 7-bit codewords
+    to_bits = ecc_encode if ecc else bytes2bits
+    bits_per_byte = BITS_PER_BYTE if ecc else 8
+
+    # bits that do not fill a whole channel slot are carried over to the next chunk
+    carry = np.zeros(0, dtype=np.uint8)
+    scattered = bytearray()
+
+    for chunk in chunks:
+        chunk = memoryview(chunk).cast("B")
+        num_bytes += len(chunk)
+
+        # checks if the data so far can fit in the provided image
+        if (offset + pixels_needed(num_bytes, bits, channels, bits_per_byte) > num_pixels):
+            raise ValueError("TEXT DOES NOT FIT IN IMAGE")
+
+        if (header):
+            crc = zlib.crc32(chunk, crc)
+
+        if (seed is not None):
+            scattered += chunk
+            continue
+
+        chunk_bits = np.concatenate((carry, to_bits(chunk)))
+        aligned = len(chunk_bits) - len(chunk_bits)%bits
+
+        with stage("embed", -(-aligned // (bits*len(channels)))):
+            embed_bits_sharded(arr, chunk_bits[:aligned], bits, channels, start=written, workers=workers)
+
+        carry = chunk_bits[aligned:]
+        written += aligned
+
+    if (len(carry) > 0):
+        with stage("embed", 1):
+            embed_bits(arr, carry, bits, channels, start=written)
+
+    if (seed is not None):
+        # pixel indexes are cached, so encoding same-sized images with the same seed and length reuses them
+        index = scatter_index(seed, arr.shape, offset, pixels_needed(num_bytes, bits, channels, bits_per_byte))
+
+        with stage("embed", len(index)):
+            embed_scattered_sharded(arr, to_bits(scattered), index, bits, channels, workers=workers)
+
+    if (header):
+        if (offset > num_pixels):
+            raise ValueError("TEXT DOES NOT FIT IN IMAGE")
+
+        with stage("embed", HEADER_PIXELS):
+            flags = (FLAG_SCATTERED if seed is not None else 0) | (FLAG_ECC if ecc else 0) | COMPRESSION_FLAGS.get(compression, 0)
+            embed_bits(arr, bytes2bits(pack_header(Header(num_bytes, bits, channels, crc, flags))))
+
+    return as_output(arr, img), TextKey(num_bytes, bits, channels, header, ecc, compression)
+
+def encode_frames(data, output_path: str, img_path: str=None, img: Image.Image=None, bits: int=1, channels: str="G", header: bool=False) -> TextKey:
+    """
+    Encodes data across the frames of a multi-frame image (e.g. animated GIF or APNG, multi-page TIFF), one frame at a time.
+
+    Args:
+        data (bytes-like | str): The data to be encoded. Text is encoded as UTF-8.
+        output_path (str): The path the encoded frames are written to, as a multi-page TIFF.
+        img_path (str, optional): The path to the image file. Defaults to None.
+        img (Image.Image, optional): The image object. Defaults to None.
+        bits (int, optional): The number of lower order bits (1-4) used in each channel. Defaults to 1.
+        channels (str, optional): The channels used, any subset of "RGB". Defaults to "G".
+        header (bool, optional): Whether to embed a header with the length, settings and CRC32 of the data in the first frame. Defaults to False.
+
+    Returns:
+        TextKey | ValueError: The key, which is the number of encoded bytes (int) carrying the embedding settings.
 
-    curr = (0, 0)
-    for b in bin_encodings:
-        if (curr[0] == length):
-            curr = (0, curr[1]+1)
+    Raises:
+        ValueError: If neither img_path nor img is provided.
+        ValueError: If the embedding settings are invalid.
+        ValueError: If the data does not fit in the frames. Nothing is left at output_path.
+
+    Note:
+        - The data fills the frames in order, each in row-major order, so it may be larger than one frame can hold.
+        - Only one frame is decoded and held in memory at a time, and each is appended to the output as soon as it is encoded.
+        - The output is a lossless multi-page TIFF, since GIF palettes would destroy the payload. Frame timing is not kept.
+
+    Example:
+        key = encode_frames(b"payload", "encoded.tiff", img_path="animation.gif")
+    """
+
+    # checks if at least one image argument is provided
+    if (img_path is None and img is None):
+        raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
+
+    bits, channels = check_embedding(bits, channels)
+
+    if (isinstance(data, str)):
+        data = data.encode("utf-8")
+
+    data = memoryview(data).cast("B")
+    remaining = len(data)*8
+    written = 0
+
+    if (img is None):
+        img = Image.open(img_path)
 
-        p = img.getpixel(curr)
-        img.putpixel(curr, encode_lsb(p, b))
+    try:
+        with TiffImagePlugin.AppendingTiffWriter(output_path, new=True) as tiff:
+            for i, frame in enumerate(ImageSequence.Iterator(img)):
+                arr = img2arr(frame)
 
-        curr = (curr[0]+1, curr[1])
+                # the header is held by the first frame, ahead of its share of the payload
+                offset = HEADER_PIXELS if (header and i == 0) else 0
+                capacity = max(arr.shape[0]*arr.shape[1] - offset, 0)*len(channels)*bits
+                count = min(remaining, capacity)
 
-    return img, len(encoded_text)
+                if (count > 0):
+                    with stage("embed", -(-count // (bits*len(channels)))):
+                        embed_bits(arr, bit_range(data, written, count), bits, channels, start=offset*len(channels)*bits)
 
-def encode_stencil(encoded_text: str,img_path: str=None, img: Image.Image=None, text_size=50, text_coords=(0, 0)) -> Tuple:
+                    written += count
+                    remaining -= count
+
+                if (offset > 0):
+                    if (offset > arr.shape[0]*arr.shape[1]):
+                        raise ValueError("TEXT DOES NOT FIT IN IMAGE")
+
+                    embed_bits(arr, bytes2bits(pack_header(Header(len(data), bits, channels, zlib.crc32(data)))))
+
+                with stage("to_image", arr.shape[0]*arr.shape[1]):
+                    Image.fromarray(arr).save(tiff, format="TIFF")
+
+                tiff.newFrame()
+
+        if (remaining > 0):
+            raise ValueError("TEXT DOES NOT FIT IN IMAGE")
+    except BaseException:
+        if (os.path.exists(output_path)):
+            os.remove(output_path)
+        raise
+
+    return TextKey(len(data), bits, channels, header)
+
+def encode_stencil(encoded_text: str,img_path: str=None, img: Union[Image.Image, np.ndarray]=None, text_size=50, text_coords=(0, 0), inplace: bool=False, workers: int=1) -> Tuple:
     """
     Encodes the text into the image as a stencil (symmetric cipher).
 
     Args:
         encoded_text (str): The text to be encoded into the image.
         img_path (str, optional): The path to the image file. Defaults to None.
-        img (Image.Image, optional): The image object. Defaults to None.
+        img (Image.Image | np.ndarray, optional): The image object, or an HxWx3 uint8 RGB array. Defaults to None.
         text_size (int, optional): The size of the text in pixels. Defaults to 50.
         text_coords (tuple, optional): The coordinates (x, y) where the top-left corner of the text will be placed on the image. Defaults to (0, 0).
+        inplace (bool, optional): Whether to encode into the img array itself instead of a copy. Defaults to False.
+        workers (int, optional): The number of threads stamping bands of the stencil rows in parallel, None for one per CPU.
+            Only pays off for stencils of millions of pixels. Defaults to 1.
 
     Returns:
-        tuple | ValueError: A tuple containing the encoded image (Image.Image) and the key (int) used for encoding.
+        tuple | ValueError: A tuple containing the encoded image (Image.Image, or np.ndarray if img is an array) and the key (int) used for encoding.
 
     Raises:
         ValueError: If neither img_path nor img argument is provided.
+        ValueError: If img is an array that is not HxWx3 uint8, or inplace is set without a writable, C-contiguous array.
         ValueError: If the text does not fit on the image.
         ValueError: If the encoded text does not contain at least one character.
+        ValueError: If workers is less than 1.
     """
 
     # checks if at least one image argument is provided
-    if (img_path == None and img == None):
+    if (img_path is None and img is None):
         raise ValueError("MUST PROVIDE IMAGE ARGUMENT")
-    
-    if (img_path != None and img == None):
-        img = Image.open(img_path).convert("RGB")
-    else:
-        # default to using img argument
-        img = img.convert("RGB")
-    
-    length, height = img.getbbox()[2]-img.getbbox()[0], img.getbbox()[3]-img.getbbox()[1]
-    fnt = ImageFont.load_default(text_size)
-    text_length = int(fnt.getlength(encoded_text))
+
+    workers = check_workers(workers)
+
+    # defaults to using img argument, converted once to an RGB array
+    arr = load_image(img_path, img, inplace)
+    height, length = arr.shape[:2]
+
+    # generate stencil, fonts and stencils are cached across calls
+    mask = text_mask(encoded_text, text_size)
+    text_length = mask.shape[1]
 
     # check valid arguments
     if (text_length+text_coords[0] > length or text_size+text_coords[1] > height):
@@ -100,15 +400,9 @@ def encode_stencil(encoded_text: str,img_path: str=None, img: Image.Image=None,
     elif (encoded_text.isspace()):
         raise ValueError("ENCODED TEXT MUST CONTAIN AT LEAST ONE CHARACTER")
     
-    # generate stencil
-    text_img = make_text_img(fnt, encoded_text, text_size)
-
     key = generate_key()
 
-    for y in range(text_size):
-        for x in range(text_length):
-            if (text_img.getpixel((x, y)) == (0, 255, 0)):
-                adjusted_coords = (x+text_coords[0], y+text_coords[1])
-                img.putpixel(adjusted_coords, encode_pixel(img.getpixel(adjusted_coords), key))
+    with stage("stamp", mask.size):
+        stamp_stencil_sharded(arr, mask, key, text_coords, workers)
 
-    return img, key
\ No newline at end of file
+    return as_output(arr, img), key
\ No newline at end of file
@@ -0,0 +1,135 @@
+import numpy as np
+import os
+import zlib
+from PIL import Image
+from typing import Union
+
+from .helper import check_array
+from .timing import stage
+
+# zlib strategies for PNG output, "filtered" and "rle" trade size for speed on photos and flat images
+PNG_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+    "rle": zlib.Z_RLE,
+    "fixed": zlib.Z_FIXED,
+}
+
+def save_image(img: Union[Image.Image, np.ndarray], path: str, compress_level: int=6, strategy: str="default") -> None:
+    """
+    Saves an encoded image or RGB array, in the format given by the extension of path.
+
+    Args:
+        img (Image.Image | np.ndarray): The image object, or an HxWx3 uint8 RGB array.
+        path (str): The path to write to. ".npy" files are written with np.save, other formats with Pillow.
+        compress_level (int, optional): PNG zlib level, from 0 (stored, fastest) to 9 (smallest). Defaults to 6.
+        strategy (str, optional): PNG zlib strategy, one of "default", "filtered", "huffman", "rle" or "fixed". Defaults to "default".
+
+    Raises:
+        ValueError: If compress_level or strategy is invalid.
+        ValueError: If img is an array that is not HxWx3 uint8.
+
+    Note:
+        - PNG compression usually costs more than encoding. Level 0-1 or the "rle"/"huffman" strategies cut it
+          for intermediate files, and uncompressed formats (".npy", ".bmp", ".tiff") skip it entirely.
+        - TIFF files are written uncompressed, so open_image can map them.
+    """
+
+    if (compress_level not in range(10)):
+        raise ValueError("COMPRESS LEVEL MUST BE BETWEEN 0 AND 9")
+    elif (strategy not in PNG_STRATEGIES):
+        raise ValueError("STRATEGY MUST BE ONE OF default, filtered, huffman, rle OR fixed")
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if (extension == ".npy"):
+        arr = check_array(img) if isinstance(img, np.ndarray) else np.asarray(img.convert("RGB"))
+
+        with stage("save", arr.shape[0]*arr.shape[1]):
+            np.save(path, arr)
+        return
+
+    if (isinstance(img, np.ndarray)):
+        img = Image.fromarray(check_array(img))
+
+    with stage("save", img.size[0]*img.size[1]):
+        if (extension == ".png"):
+            img.save(path, format="PNG", compress_level=compress_level, compress_type=PNG_STRATEGIES[strategy])
+        elif (extension in (".tif", ".tiff")):
+            img.save(path, compression="raw")
+        else:
+            img.save(path)
+
+def open_image(path: str, mode: str="r") -> np.ndarray:
+    """
+    Maps an uncompressed image file into memory as an HxWx3 uint8 RGB array, without decoding or copying it.
+
+    Args:
+        path (str): The path to a ".npy" file, or an uncompressed 8-bit RGB image (e.g. BMP, raw TIFF, PPM).
+        mode (str, optional): "r" for read-only, "r+" to write changes through to the file,
+            or "c" for copy-on-write changes that stay in memory. Defaults to "r".
+
+    Returns:
+        np.ndarray: The memory-mapped pixels. They can be passed as img to the encoders and decoders;
+            with mode "r+" or "c", encoding with inplace=True writes straight into the map if it is C-contiguous.
+
+    Raises:
+        ValueError: If mode is invalid.
+        ValueError: If the image is compressed, or not 8-bit RGB.
+
+    Note:
+        - ".npy" files and top-down raw TIFF/PPM files map to C-contiguous arrays. BMP rows are stored
+          bottom-up in BGR order, so BMP files map to a strided view that can be read or copied, but not encoded in place.
+
+    Example:
+        arr = open_image("frame.npy", mode="r+")
+        encode_text("Hello, world!", img=arr, inplace=True)
+        arr.flush()
+    """
+
+    if (mode not in ("r", "r+", "c")):
+        raise ValueError("MODE MUST BE ONE OF r, r+ OR c")
+
+    if (os.path.splitext(path)[1].lower() == ".npy"):
+        return check_array(np.load(path, mmap_mode=mode))
+
+    with Image.open(path) as img:
+        length, height = img.size
+        # tiles are (codec, extents, offset, args)
+        tiles = sorted(img.tile, key=lambda tile: tile[1][1])
+
+    raw = [tile for tile in tiles if tile[0] == "raw"]
+    rawmode, stride, orientation = _raw_args(raw[0][3]) if raw else (None, 0, 1)
+    stride = stride or length*3
+
+    # one raw RGB/BGR region, possibly split into full-width strips stored back to back
+    if (len(raw) != len(tiles) or rawmode not in ("RGB", "BGR") or any(_raw_args(tile[3]) != _raw_args(raw[0][3]) for tile in raw)):
+        raise ValueError("IMAGE MUST BE UNCOMPRESSED 8-BIT RGB")
+
+    offset = raw[0][2]
+
+    for _, (x0, y0, x1, y1), tile_offset, _ in raw:
+        if (x0 != 0 or x1 != length or tile_offset != offset + y0*stride):
+            raise ValueError("IMAGE MUST BE UNCOMPRESSED 8-BIT RGB")
+
+    # rows may be padded past the pixels, splitting the row axis keeps the map a view
+    data = np.memmap(path, dtype=np.uint8, mode=mode, offset=offset, shape=(height, stride))
+    arr = data[:, :length*3].reshape(height, length, 3)
+
+    if (orientation < 0):
+        arr = arr[::-1]
+    if (rawmode == "BGR"):
+        arr = arr[..., ::-1]
+
+    return arr
+
+def _raw_args(args) -> tuple:
+    """
+    Normalizes the arguments of a raw tile to (rawmode, stride, orientation).
+    """
+
+    if (isinstance(args, str)):
+        return args, 0, 1
+
+    return (tuple(args) + (0, 1))[:3]
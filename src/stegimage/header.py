@@ -0,0 +1,58 @@
+import struct
+from typing import NamedTuple
+
+MAGIC = b"STEG"
+VERSION = 1
+
+# magic, version, flags, bits, channels, payload length, payload CRC32
+HEADER_FORMAT = ">4sBBBBII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# the header is always held in the green channel LSB of the first pixels, the payload follows it
+HEADER_PIXELS = HEADER_SIZE*8
+
+CHANNEL_FLAGS = {"R": 0b100, "G": 0b010, "B": 0b001}
+
+# header flags, the payload is scattered over the image with a seed, or Hamming(7,4) coded
+FLAG_SCATTERED = 0b1
+FLAG_ECC = 0b10
+
+# two flag bits hold the codec the payload was compressed with, if any
+FLAG_COMPRESSION = 0b1100
+COMPRESSION_FLAGS = {"zlib": 0b0100, "lzma": 0b1000, "bz2": 0b1100}
+
+class Header(NamedTuple):
+    """
+    Self-describing header embedded ahead of a payload.
+    """
+
+    length: int
+    bits: int = 1
+    channels: str = "G"
+    crc: int = 0
+    flags: int = 0
+
+def pack_header(header: Header) -> bytes:
+    """
+    Serializes header to HEADER_SIZE bytes.
+    """
+
+    channels = sum(CHANNEL_FLAGS[c] for c in header.channels)
+
+    return struct.pack(HEADER_FORMAT, MAGIC, VERSION, header.flags, header.bits, channels, header.length, header.crc)
+
+def unpack_header(data: bytes) -> Header:
+    """
+    Parses HEADER_SIZE bytes to a header.
+    """
+
+    magic, version, flags, bits, channels, length, crc = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+
+    if (magic != MAGIC):
+        raise ValueError("IMAGE DOES NOT CONTAIN A HEADER")
+    elif (version > VERSION):
+        raise ValueError("UNSUPPORTED HEADER VERSION")
+
+    channels = "".join(c for c in "RGB" if channels & CHANNEL_FLAGS[c])
+
+    return Header(length, bits, channels, crc, flags)
@@ -1,5 +1,26 @@
 from PIL import Image, ImageDraw, ImageFont
+import io
+import numpy as np
 import random
+import struct
+import zlib
+from typing import Iterator, Tuple
+from .cache import FONT_CACHE, MASK_CACHE, INDEX_CACHE
+from .timing import stage
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# number of samples per pixel for each PNG color type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# chunks before the image data that are needed to decode the pixels
+PNG_HEADER_CHUNKS = (b"PLTE", b"tRNS", b"gAMA", b"cHRM", b"sRGB", b"iCCP", b"sBIT")
+
+# scattered pixels are a Feistel permutation keyed by the seed, with splitmix64 as the round function,
+# so they only depend on this code and not on the NumPy random generators
+SCATTER_ROUNDS = 4
+SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+SPLITMIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
 
 def encode_pixel(pixel: tuple, key: int) -> tuple:
     """
@@ -57,6 +78,41 @@ def make_text_img(fnt: ImageFont.ImageFont, text: str, text_size: int) -> Image.
 
     return text_img
 
+def make_text_mask(fnt: ImageFont.ImageFont, text: str, text_size: int) -> np.ndarray:
+    """
+    Rasterizes text to a boolean (text_size, text_length) mask of its fully covered pixels,
+    matching the green pixels of make_text_img.
+    """
+
+    text_length = int(fnt.getlength(text))
+
+    text_img = Image.new("L", (text_length, text_size), color=0)
+    draw = ImageDraw.Draw(text_img)
+    draw.text((0, 0), text=text, fill=255, font=fnt)
+
+    return np.asarray(text_img) == 255
+
+def load_font(text_size: int) -> ImageFont.ImageFont:
+    """
+    Returns the default font at text_size, loaded once and cached.
+    """
+
+    return FONT_CACHE.get(text_size, lambda: ImageFont.load_default(text_size))
+
+def text_mask(text: str, text_size: int) -> np.ndarray:
+    """
+    Returns the read-only mask of text at text_size from make_text_mask, rendered once and cached.
+    """
+
+    def render():
+        with stage("render"):
+            mask = make_text_mask(load_font(text_size), text, text_size)
+
+        mask.flags.writeable = False
+        return mask
+
+    return MASK_CACHE.get((text, text_size), render)
+
 def generate_key() -> int:
     """
     Generates 4 digit key.
@@ -113,3 +169,481 @@ def get_encrypted_bit(pixel: tuple) -> int:
     """
 
     return pixel[1] & 0b1
+
+def img2arr(img: Image.Image) -> np.ndarray:
+    """
+    Converts image to a writable HxWx3 uint8 RGB array.
+    """
+
+    length, height = img.size
+
+    # lazily opened files are decoded first, so it is timed apart from the conversion
+    with stage("decode", length*height):
+        img.load()
+
+    with stage("convert", length*height):
+        if (img.mode != "RGB"):
+            img = img.convert("RGB")
+
+        return np.array(img, dtype=np.uint8)
+
+def check_array(arr: np.ndarray) -> np.ndarray:
+    """
+    Checks array is an HxWx3 uint8 RGB array.
+    """
+
+    if (arr.dtype != np.uint8 or arr.ndim != 3 or arr.shape[2] != 3):
+        raise ValueError("ARRAY MUST BE HxWx3 UINT8")
+
+    return arr
+
+def load_image(img_path: str=None, img=None, inplace: bool=False) -> np.ndarray:
+    """
+    Returns a writable RGB array of the image argument, preferring img over img_path.
+    Arrays are copied unless inplace, in which case the caller's array itself is returned.
+    """
+
+    if (isinstance(img, np.ndarray)):
+        check_array(img)
+
+        if (not inplace):
+            return img.copy()
+        elif (not img.flags.writeable or not img.flags.c_contiguous):
+            raise ValueError("INPLACE ARRAY MUST BE WRITABLE AND C-CONTIGUOUS")
+
+        return img
+    elif (inplace):
+        raise ValueError("INPLACE REQUIRES AN ARRAY")
+
+    if (img is None):
+        img = Image.open(img_path)
+
+    return img2arr(img)
+
+def image_size(img_path: str=None, img=None) -> Tuple:
+    """
+    Returns (length, height) of the image argument, reading only the header of files.
+    """
+
+    if (isinstance(img, np.ndarray)):
+        return check_array(img).shape[1], img.shape[0]
+    elif (img is None):
+        return Image.open(img_path).size
+
+    return img.size
+
+def as_output(arr: np.ndarray, img):
+    """
+    Returns arr as an image, or as is if the image argument was an array.
+    """
+
+    if (isinstance(img, np.ndarray)):
+        return arr
+
+    with stage("to_image", arr.shape[0]*arr.shape[1]):
+        return Image.fromarray(arr)
+
+def bytes2bits(data) -> np.ndarray:
+    """
+    Converts any bytes-like object to a flat array of bits, without copying the data.
+    """
+
+    return np.unpackbits(np.frombuffer(memoryview(data).cast("B"), dtype=np.uint8))
+
+def bit_range(data, start: int, count: int) -> np.ndarray:
+    """
+    Returns count bits of a bytes-like object from bit position start, unpacking only the bytes spanned.
+    """
+
+    data = memoryview(data).cast("B")
+
+    return bytes2bits(data[start//8:-(-(start+count)//8)])[start%8:start%8+count]
+
+def read_chunks(stream, chunk_size: int=65536) -> Iterator:
+    """
+    Yields chunks from a file-like object with a read method, or from an iterable of chunks.
+    """
+
+    if (not hasattr(stream, "read")):
+        yield from stream
+        return
+
+    while True:
+        chunk = stream.read(chunk_size)
+
+        if (not chunk):
+            return
+
+        yield chunk
+
+def bits2bytes(bits: np.ndarray) -> bytes:
+    """
+    Converts a flat array of bits to bytes.
+    """
+
+    return np.packbits(bits).tobytes()
+
+class TextKey(int):
+    """
+    Key returned by encode_text and encode_bytes: the number of embedded (compressed, if compression paid off) bytes, carrying the embedding settings used.
+    """
+
+    def __new__(cls, length: int, bits: int=1, channels: str="G", header: bool=False, ecc: bool=False, compression: str=None):
+        key = super().__new__(cls, length)
+        key.bits = bits
+        key.channels = channels
+        key.header = header
+        key.ecc = ecc
+        key.compression = compression
+
+        return key
+
+    def __reduce__(self):
+        return (TextKey, (int(self), self.bits, self.channels, self.header, self.ecc, self.compression))
+
+    def __repr__(self):
+        return f"TextKey({int(self)}, bits={self.bits}, channels={self.channels!r}, header={self.header}, ecc={self.ecc}, compression={self.compression!r})"
+
+def check_embedding(bits: int, channels: str) -> Tuple:
+    """
+    Validates embedding settings, returning them with channels in RGB order.
+    """
+
+    if (bits not in (1, 2, 3, 4)):
+        raise ValueError("BITS MUST BE BETWEEN 1 AND 4")
+    
+    channels = channels.upper()
+
+    if (len(channels) == 0 or len(set(channels)) != len(channels) or not set(channels) <= set("RGB")):
+        raise ValueError("CHANNELS MUST BE A SUBSET OF RGB")
+
+    return bits, "".join(c for c in "RGB" if c in channels)
+
+def pixels_needed(num_bytes: int, bits: int=1, channels: str="G", bits_per_byte: int=8) -> int:
+    """
+    Returns the number of pixels holding num_bytes at the given embedding settings,
+    with bits_per_byte embedded bits for each byte (more with error correction).
+    """
+
+    slots = -(-num_bytes*bits_per_byte // bits)
+
+    return -(-slots // len(channels))
+
+def channel_cols(channels: str) -> list:
+    """
+    Returns the column index of each channel.
+    """
+
+    return ["RGB".index(c) for c in channels]
+
+def channel_slots(flat: np.ndarray, first: int, offset: int, channels: str) -> Iterator:
+    """
+    Yields, for each channel, the slice of the consecutive slots from slot offset of pixel first on (row-major channel order)
+    that it holds, and the view of its column from its first such slot on, so channels are read and written without fancy-index copies.
+    """
+
+    # with all three channels the slots are the bytes of the pixels, one contiguous run
+    if (len(channels) == 3):
+        yield slice(None), flat.reshape(-1)[first*3+offset:]
+        return
+
+    for j, col in enumerate(channel_cols(channels)):
+        k = (j-offset) % len(channels)
+        yield slice(k, None, len(channels)), flat[first+(offset+k)//len(channels):, col]
+
+def bits2values(bits: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Packs every depth bits (most significant first) into one slot value, the last one padded with zeros.
+    """
+
+    if (depth == 1):
+        return bits
+
+    count = -(-len(bits) // depth)
+
+    if (depth == 3):
+        groups = np.zeros(count*3, dtype=np.uint8)
+        groups[:len(bits)] = bits
+        groups = groups.reshape(-1, 3)
+        return (groups[:, 0] << np.uint8(2)) | (groups[:, 1] << np.uint8(1)) | groups[:, 2]
+
+    # depth 2 and 4 divide a byte, so the values are cut out of the packed bytes with shifts
+    shifts = np.arange(8-depth, -1, -depth, dtype=np.uint8)
+
+    return ((np.packbits(bits)[:, None] >> shifts) & np.uint8((1 << depth) - 1)).reshape(-1)[:count]
+
+def values2bits(values: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Unpacks slot values of depth bits each into a flat array of bits, most significant first.
+    """
+
+    if (depth == 1):
+        return values
+    elif (depth == 3):
+        bits = np.empty((len(values), 3), dtype=np.uint8)
+        bits[:, 0] = values >> np.uint8(2)
+        bits[:, 1] = (values >> np.uint8(1)) & np.uint8(1)
+        bits[:, 2] = values & np.uint8(1)
+        return bits.reshape(-1)
+
+    # depth 2 and 4 divide a byte, so the values are combined into bytes with shifts and unpacked once
+    per_byte = 8 // depth
+    groups = np.zeros(-(-len(values) // per_byte)*per_byte, dtype=np.uint8)
+    groups[:len(values)] = values
+    groups = groups.reshape(-1, per_byte)
+    packed = groups[:, 0] << np.uint8(8-depth)
+
+    for i in range(1, per_byte):
+        packed |= groups[:, i] << np.uint8(8-depth*(i+1))
+
+    return np.unpackbits(packed)[:len(values)*depth]
+
+def embed_bits(arr: np.ndarray, bits: np.ndarray, depth: int=1, channels: str="G", start: int=0) -> None:
+    """
+    Replaces the depth lower order bits of the given channels of the pixels (row-major) with bits, in place.
+    Writing begins at bit position start, which must be a multiple of depth.
+    """
+
+    values = bits2values(bits, depth)
+    keep = np.uint8((0xFF << depth) & 0xFF)
+
+    # values go to consecutive slots from start, every len(channels)th one in the same channel
+    first, offset = divmod(start // depth, len(channels))
+
+    for slots, column in channel_slots(arr.reshape(-1, 3), first, offset, channels):
+        part = values[slots]
+        column = column[:len(part)]
+        column &= keep
+        column |= part
+
+def extract_bits(arr: np.ndarray, count: int, depth: int=1, channels: str="G", start: int=0) -> np.ndarray:
+    """
+    Returns count bits, from bit position start, held in the depth lower order bits of the given channels of the pixels (row-major).
+    """
+
+    # slots holding bits start to start+count, in row-major channel order
+    first_slot, last_slot = start // depth, -(-(start+count) // depth)
+    first, offset = divmod(first_slot, len(channels))
+    num_slots = last_slot-first_slot
+    low = np.uint8((1 << depth) - 1)
+
+    if (len(channels) in (1, 3)):
+        values = next(channel_slots(arr.reshape(-1, 3), first, offset, channels))[1][:num_slots] & low
+    else:
+        values = np.empty(num_slots, dtype=np.uint8)
+
+        for slots, column in channel_slots(arr.reshape(-1, 3), first, offset, channels):
+            part = values[slots]
+            np.bitwise_and(column[:len(part)], low, out=part)
+
+    bits = values2bits(values, depth)
+
+    return bits[start-first_slot*depth:start-first_slot*depth+count]
+
+def splitmix64(x: np.ndarray) -> np.ndarray:
+    """
+    Mixes every uint64 of x with the splitmix64 finalizer, wrapping around on overflow.
+    """
+
+    x = x ^ (x >> np.uint64(30))
+    x = x*SPLITMIX_MULTIPLIERS[0]
+    x ^= x >> np.uint64(27)
+    x *= SPLITMIX_MULTIPLIERS[1]
+
+    return x ^ (x >> np.uint64(31))
+
+def permute_index(seed: int, size: int, index: np.ndarray) -> np.ndarray:
+    """
+    Maps index through a pseudorandom permutation of range(size) chosen by seed.
+    Each (seed, index) is hashed on its own, so any part of the permutation is computed without the rest.
+    """
+
+    # a balanced Feistel network permutes 2*half bits, values past size are mapped again until they fall in range
+    half = max(1, -(-(size-1).bit_length() // 2))
+    mask = np.uint64((1 << half)-1)
+    keys = splitmix64(np.uint64(seed & 0xFFFFFFFFFFFFFFFF) + SPLITMIX_GAMMA*np.arange(1, SCATTER_ROUNDS+1, dtype=np.uint64))
+
+    def feistel(x):
+        left, right = x >> np.uint64(half), x & mask
+
+        for key in keys:
+            left, right = right, left ^ (splitmix64(right ^ key) & mask)
+
+        return (left << np.uint64(half)) | right
+
+    out = feistel(index.astype(np.uint64))
+    outside = np.flatnonzero(out >= size)
+
+    while (len(outside)):
+        out[outside] = feistel(out[outside])
+        outside = outside[out[outside] >= size]
+
+    return out.astype(np.int64)
+
+def scatter_index(seed: int, shape: Tuple, offset: int, count: int) -> np.ndarray:
+    """
+    Returns the read-only, ascending indexes of count distinct pixels (row-major) from offset on, chosen pseudorandomly by seed.
+    Computed once per (seed, shape, offset, count) and cached.
+    """
+
+    def create():
+        num_pixels = shape[0]*shape[1]
+        index = permute_index(seed, num_pixels-offset, np.arange(count, dtype=np.uint64)) + offset
+
+        # the chosen pixels are the secret, sorting them keeps gathers and scatters cache friendly
+        index.sort()
+        index.flags.writeable = False
+        return index
+
+    return INDEX_CACHE.get((seed, tuple(shape[:2]), offset, count), create)
+
+def embed_scattered(arr: np.ndarray, bits: np.ndarray, index: np.ndarray, depth: int=1, channels: str="G") -> None:
+    """
+    Embeds bits into the pixels at index (row-major), in place, with a single gather and scatter.
+    """
+
+    flat = arr.reshape(-1, 3)
+    pixels = flat[index]
+    embed_bits(pixels, bits, depth, channels)
+    flat[index] = pixels
+
+def extract_scattered(arr: np.ndarray, count: int, index: np.ndarray, depth: int=1, channels: str="G") -> np.ndarray:
+    """
+    Returns count bits held in the pixels at index (row-major), with a single gather.
+    """
+
+    return extract_bits(arr.reshape(-1, 3)[index], count, depth, channels)
+
+def pixel_codes(arr: np.ndarray) -> np.ndarray:
+    """
+    Returns the 6-bit code held in the 2 lower order bits of each pixel's RGB values.
+    """
+
+    return ((arr[..., 0] & 0b11) << 4) | ((arr[..., 1] & 0b11) << 2) | (arr[..., 2] & 0b11)
+
+def match_stencil(arr: np.ndarray, key: int) -> np.ndarray:
+    """
+    Returns boolean mask of pixels encoded using key.
+    """
+
+    return pixel_codes(arr) == key%64
+
+def stamp_stencil(arr: np.ndarray, mask: np.ndarray, key: int, coords: tuple=(0, 0)) -> None:
+    """
+    Encodes the key into the lower order bits of the pixels under mask, placed at coords (x, y), in place.
+    """
+
+    key = key%64
+    code = np.array([key >> 4, (key >> 2) & 0b11, key & 0b11], dtype=np.uint8)
+
+    region = arr[coords[1]:coords[1]+mask.shape[0], coords[0]:coords[0]+mask.shape[1]]
+    region[mask] = (region[mask] & 0b11111100) | code
+
+def mask2rle(mask: np.ndarray) -> Tuple:
+    """
+    Compresses boolean mask to its bounding box (x0, y0, x1, y1) and the run lengths of
+    the row-major mask inside the box, starting with a run of False values.
+    """
+
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+
+    if (len(rows) == 0):
+        return None, np.zeros(0, dtype=np.uint32)
+
+    x0, y0, x1, y1 = cols[0], rows[0], cols[-1]+1, rows[-1]+1
+    flat = mask[y0:y1, x0:x1].ravel()
+
+    # run boundaries are where consecutive values differ, the first run is always False
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [len(flat)]))
+    runs = np.diff(bounds)
+    if (flat[0]):
+        runs = np.concatenate(([0], runs))
+
+    return (int(x0), int(y0), int(x1), int(y1)), runs.astype(np.uint32)
+
+def rle2mask(bbox: tuple, runs: np.ndarray, size: tuple) -> np.ndarray:
+    """
+    Expands bounding box and run lengths from mask2rle back to a boolean mask of the given (length, height).
+    """
+
+    mask = np.zeros((size[1], size[0]), dtype=bool)
+
+    if (bbox is None):
+        return mask
+
+    x0, y0, x1, y1 = bbox
+    values = np.arange(len(runs)) % 2 == 1
+    mask[y0:y1, x0:x1] = np.repeat(values, runs).reshape(y1-y0, x1-x0)
+
+    return mask
+
+def png_chunk(cid: bytes, body: bytes) -> bytes:
+    """
+    Serializes a PNG chunk with its length and CRC.
+    """
+
+    return struct.pack(">I", len(body)) + cid + body + struct.pack(">I", zlib.crc32(cid + body))
+
+def read_png_rows(img_path: str, rows: int) -> Image.Image:
+    """
+    Decodes only the top rows of a non-interlaced PNG file.
+    Image data is decompressed up to the last needed row and the rest of the file is never read.
+    """
+
+    with open(img_path, "rb") as f:
+        if (f.read(8) != PNG_SIGNATURE):
+            raise ValueError("NOT A PNG FILE")
+
+        chunks = []
+        inflater = zlib.decompressobj()
+        data = []
+        received = 0
+
+        while True:
+            length, cid = struct.unpack(">I4s", f.read(8))
+            body = f.read(length)
+            f.read(4) # CRC
+
+            if (cid == b"IHDR"):
+                length, height, depth, color = struct.unpack(">IIBB", body[:10])
+                # every row starts with a filter type byte
+                needed = rows * (1 + (length*depth*PNG_CHANNELS[color] + 7)//8)
+                chunks.append(png_chunk(cid, body[:4] + struct.pack(">I", rows) + body[8:]))
+            elif (cid in PNG_HEADER_CHUNKS):
+                chunks.append(png_chunk(cid, body))
+            elif (cid == b"IDAT"):
+                data.append(inflater.decompress(body, needed-received))
+                received += len(data[-1])
+            
+            if (cid == b"IEND" or (cid == b"IDAT" and received >= needed)):
+                break
+
+    # rebuild a small PNG holding only the decompressed rows, left to PIL to unfilter
+    idat = zlib.compress(b"".join(data), 1)
+    png = PNG_SIGNATURE + b"".join(chunks) + png_chunk(b"IDAT", idat) + png_chunk(b"IEND", b"")
+
+    img = Image.open(io.BytesIO(png))
+    img.load()
+
+    return img
+
+def open_rows(img_path: str, rows: int) -> Image.Image:
+    """
+    Opens only the top rows of an image file.
+    Non-interlaced PNG files are partially decoded, other formats are loaded in full and cropped.
+    """
+
+    img = Image.open(img_path)
+    length, height = img.size
+
+    if (rows >= height):
+        return img
+    elif (img.format == "PNG" and not img.info.get("interlace")):
+        img.close()
+
+        with stage("decode", length*rows):
+            return read_png_rows(img_path, rows)
+
+    with stage("decode", length*height):
+        return img.crop((0, 0, length, rows))
@@ -0,0 +1,113 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from .helper import embed_bits, embed_scattered, match_stencil, stamp_stencil
+
+# shards of fewer pixels cost more to schedule than they save
+MIN_SHARD_PIXELS = 1 << 20
+
+_EXECUTOR = None
+_LOCK = threading.Lock()
+
+def check_workers(workers: int) -> int:
+    """
+    Validates the number of workers, None meaning one per CPU.
+    """
+
+    if (workers is None):
+        return os.cpu_count() or 1
+    elif (workers < 1):
+        raise ValueError("WORKERS MUST BE AT LEAST 1")
+
+    return workers
+
+def shard_bounds(start: int, stop: int, workers: int, min_size: int=1) -> List[Tuple]:
+    """
+    Splits range(start, stop) into at most workers contiguous (start, stop) shards of at least min_size, except when it is smaller.
+    """
+
+    count = max(1, min(workers, (stop-start) // max(min_size, 1)))
+    edges = np.linspace(start, stop, count+1).astype(np.int64)
+
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:])]
+
+def run_shards(func: Callable, bounds: List[Tuple]) -> list:
+    """
+    Calls func(start, stop) for every shard and returns the results in order, on a shared thread pool when there are several.
+    NumPy releases the GIL in the array operations, so the shards run in parallel on the same memory without copying it.
+    """
+
+    if (len(bounds) <= 1):
+        return [func(*bound) for bound in bounds]
+
+    futures = [_executor().submit(func, *bound) for bound in bounds]
+
+    return [future.result() for future in futures]
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+
+    with _LOCK:
+        if (_EXECUTOR is None):
+            _EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="stegimage-shard")
+
+        return _EXECUTOR
+
+def embed_bits_sharded(arr: np.ndarray, bits: np.ndarray, depth: int=1, channels: str="G", start: int=0, workers: int=1) -> None:
+    """
+    embed_bits split into runs of whole pixels, embedded by up to workers threads.
+    """
+
+    per_pixel = depth*len(channels)
+    first, last = start // per_pixel, -(-(start+len(bits)) // per_pixel)
+
+    def embed(a, b):
+        # bits of pixels a to b, clipped to the payload
+        lo, hi = max(a*per_pixel-start, 0), min(b*per_pixel-start, len(bits))
+        embed_bits(arr, bits[lo:hi], depth, channels, start=start+lo)
+
+    run_shards(embed, shard_bounds(first, last, workers, MIN_SHARD_PIXELS))
+
+def embed_scattered_sharded(arr: np.ndarray, bits: np.ndarray, index: np.ndarray, depth: int=1, channels: str="G", workers: int=1) -> None:
+    """
+    embed_scattered split into runs of the pixel indexes, embedded by up to workers threads.
+    """
+
+    per_pixel = depth*len(channels)
+
+    def embed(a, b):
+        embed_scattered(arr, bits[a*per_pixel:b*per_pixel], index[a:b], depth, channels)
+
+    run_shards(embed, shard_bounds(0, len(index), workers, MIN_SHARD_PIXELS))
+
+def stamp_stencil_sharded(arr: np.ndarray, mask: np.ndarray, key: int, coords: tuple=(0, 0), workers: int=1) -> None:
+    """
+    stamp_stencil split into bands of mask rows, stamped by up to workers threads.
+    """
+
+    def stamp(a, b):
+        stamp_stencil(arr, mask[a:b], key, (coords[0], coords[1]+a))
+
+    run_shards(stamp, shard_bounds(0, mask.shape[0], workers, -(-MIN_SHARD_PIXELS // max(mask.shape[1], 1))))
+
+def match_stencil_sharded(arr: np.ndarray, key: int, workers: int=1, paint: bool=False) -> np.ndarray:
+    """
+    match_stencil split into bands of rows, matched by up to workers threads.
+    With paint, the matched pixels are also set to green in the same pass over each band.
+    """
+
+    mask = np.empty(arr.shape[:2], dtype=bool)
+
+    def match(a, b):
+        mask[a:b] = match_stencil(arr[a:b], key)
+
+        if (paint):
+            arr[a:b][mask[a:b]] = (0, 255, 0)
+
+    run_shards(match, shard_bounds(0, arr.shape[0], workers, -(-MIN_SHARD_PIXELS // max(arr.shape[1], 1))))
+
+    return mask
@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Iterator, List, NamedTuple
+
+class Timing(NamedTuple):
+    """
+    Duration of one stage of a call, and the number of pixels it processed.
+    """
+
+    stage: str
+    seconds: float
+    pixels: int = 0
+
+# list and callback of the innermost active record_timings, None when timings are off
+_RECORDER = ContextVar("stegimage_timings", default=None)
+
+@contextmanager
+def record_timings(callback: Callable=None) -> Iterator[List[Timing]]:
+    """
+    Records the stages run by the encoders and decoders inside the block.
+
+    Args:
+        callback (Callable, optional): Called with each Timing as its stage finishes. Defaults to None.
+
+    Yields:
+        list: The Timing of every stage finished so far, in order.
+
+    Note:
+        - Stages are "decode" (reading image files), "convert" (to an RGB array), "render" (glyphs), "compress",
+          "embed", "stamp", "extract", "correct" (error correction), "decompress", "match" and "to_image" (array back to an image object).
+        - Recording follows the context, so it covers threads started with contextvars.copy_context().run.
+          Stages run after the block ends in such a context are still passed to callback.
+
+    Example:
+        with record_timings() as timings:
+            encode_text("Hello, world!", img_path="image.png")
+
+        print(summarize(timings))
+    """
+
+    timings = []
+
+    def record(timing):
+        timings.append(timing)
+
+        if (callback is not None):
+            callback(timing)
+
+    token = _RECORDER.set(record)
+
+    try:
+        yield timings
+    finally:
+        _RECORDER.reset(token)
+
+@contextmanager
+def stage(name: str, pixels: int=0) -> Iterator[None]:
+    """
+    Times the block as stage name if timings are being recorded.
+    """
+
+    record = _RECORDER.get()
+
+    if (record is None):
+        yield
+        return
+
+    start = perf_counter()
+
+    try:
+        yield
+    finally:
+        record(Timing(name, perf_counter()-start, pixels))
+
+def summarize(timings: List[Timing]) -> dict:
+    """
+    Returns the total seconds and pixels of each stage, in order of first appearance.
+    """
+
+    summary = {}
+
+    for timing in timings:
+        seconds, pixels = summary.get(timing.stage, (0.0, 0))
+        summary[timing.stage] = (seconds+timing.seconds, pixels+timing.pixels)
+
+    return {name: {"seconds": seconds, "pixels": pixels} for name, (seconds, pixels) in summary.items()}
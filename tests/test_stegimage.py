@@ -4,9 +4,21 @@ sys.path.append('../src/stegimage')
 from PIL import ImageFont, Image
 import pytest
 import random
+import io
+import numpy as np
 import encoder as enc
 import decoder as dec
 import helper as h
+import batch as b
+import cache as c
+import timing as t
+import cli
+import fileio as fio
+import aio
+import parallel as par
+import asyncio
+import time
+import json
 
 def test_encode_text() -> None:
     """
@@ -158,3 +170,637 @@ def test_helper_encode_lsb() -> None:
     p4 = (67, 126, 0)
     p4e = h.encode_lsb(p4, 0)
     assert p4[1] == p4e[1]
+
+def test_encode_text_matches_pixel_encoding() -> None:
+    """
+    Testing vectorized encode_text against per-pixel encode_lsb.
+    """
+
+    image = Image.open("resources/small_image.png").convert("RGB")
+    text = "Hello World"
+    im, key = enc.encode_text(text, img=image)
+
+    expected = image.copy()
+    for i, b in enumerate(h.str2bin(text)):
+        coords = (i % image.size[0], i // image.size[0])
+        expected.putpixel(coords, h.encode_lsb(expected.getpixel(coords), b))
+
+    assert im.tobytes() == expected.tobytes()
+    assert dec.decode_text(key, img=im) == text
+
+def test_decode_stencil_outputs() -> None:
+    """
+    Testing decode_stencil image, mask and rle outputs against per-pixel decoding.
+    """
+
+    im, key = enc.encode_stencil("Hello", img_path="resources/small_image.png", text_size=20, text_coords=(2, 5))
+
+    expected = im.copy()
+    for y in range(im.size[1]):
+        for x in range(im.size[0]):
+            if (h.is_encoded_pixel(im.getpixel((x, y)), key)):
+                expected.putpixel((x, y), (0, 255, 0))
+
+    assert dec.decode_stencil(key, img=im).tobytes() == expected.tobytes()
+
+    mask = dec.decode_stencil(key, img=im, output="mask")
+    assert mask.shape == (im.size[1], im.size[0])
+    assert mask.any()
+
+    bbox, runs = dec.decode_stencil(key, img=im, output="rle")
+    assert (h.rle2mask(bbox, runs, im.size) == mask).all()
+
+    with pytest.raises(ValueError) as execinfo:
+        dec.decode_stencil(key, img=im, output="jpeg")
+    assert str(execinfo.value) == "OUTPUT MUST BE ONE OF image, mask OR rle"
+
+def test_helper_make_text_mask() -> None:
+    """
+    Tests the text mask matches the green pixels of the text image.
+    """
+
+    text_size = 50
+    fnt = ImageFont.load_default(text_size)
+
+    mask = h.make_text_mask(fnt, "Hello World", text_size)
+    text_arr = np.asarray(h.make_text_img(fnt, "Hello World", text_size))
+
+    assert mask.shape == (text_size, 268)
+    assert (mask == (text_arr == (0, 255, 0)).all(axis=2)).all()
+
+def test_batch() -> None:
+    """
+    Testing batch encoding and decoding with per-item errors.
+    """
+
+    with open('resources/encoded_text.txt', 'r') as file:
+        long_text = file.read().replace('\n', '')
+
+    image = Image.open("resources/small_image.png")
+    items = [("resources/small_image.png", "Hello"), (image, "World"), ("resources/small_image.png", long_text)]
+    results = b.encode_batch(items, max_workers=2)
+
+    assert len(results) == 3
+    assert isinstance(results[2], ValueError)
+    assert str(results[2]) == "TEXT DOES NOT FIT IN IMAGE"
+
+    decoded = b.decode_batch([(im, key) for im, key in results[:2]], max_workers=2, chunksize=2)
+    assert decoded == ["Hello", "World"]
+
+def test_helper_open_rows() -> None:
+    """
+    Testing partial decoding of the top rows of a PNG file.
+    """
+
+    full = Image.open("resources/image.png")
+
+    for rows in [1, 10, 1024]:
+        im = h.open_rows("resources/image.png", rows)
+        assert im.size == (1024, rows)
+        assert im.convert("RGB").tobytes() == full.crop((0, 0, 1024, rows)).convert("RGB").tobytes()
+
+def test_encode_text_embedding_settings() -> None:
+    """
+    Testing encode_text and decode_text with multi-bit, multi-channel embedding.
+    """
+
+    with open('resources/encoded_text.txt', 'r') as file:
+        text = file.read().replace('\n', '')
+
+    for bits in [1, 2, 3, 4]:
+        for channels in ["R", "G", "B", "RB", "GB", "RGB"]:
+            im, key = enc.encode_text(text[:312], img_path="resources/small_image.png", bits=bits, channels=channels)
+            assert dec.decode_text(key, img=im) == text[:312]
+            assert dec.decode_text(int(key), img=im, bits=bits, channels=channels) == text[:312]
+
+    # 50x50 pixels hold 937 bytes at 1 bit in RGB
+    try:
+        im, key = enc.encode_text(text[:937], img_path="resources/small_image.png", channels="RGB")
+    except:
+        pytest.fail("UNEXPECTED ERROR")
+    assert dec.decode_text(key, img=im) == text[:937]
+
+    original = np.asarray(Image.open("resources/small_image.png").convert("RGB"))
+    im, key = enc.encode_text("Hello", img_path="resources/small_image.png", bits=2, channels="rb")
+    assert key.channels == "RB"
+    assert (np.asarray(im)[..., 1] == original[..., 1]).all()
+    assert (np.asarray(im) >> 2 == original >> 2).all()
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text(text[:938], img_path="resources/small_image.png", channels="RGB")
+    assert str(execinfo.value) == "TEXT DOES NOT FIT IN IMAGE"
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text(text, img_path="resources/small_image.png", bits=5)
+    assert str(execinfo.value) == "BITS MUST BE BETWEEN 1 AND 4"
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text(text, img_path="resources/small_image.png", channels="GA")
+    assert str(execinfo.value) == "CHANNELS MUST BE A SUBSET OF RGB"
+
+def test_encode_bytes() -> None:
+    """
+    Testing encode_bytes and decode_bytes with bytes-like objects, and UTF-8 text.
+    """
+
+    data = bytes(range(256))
+
+    for payload in [data, bytearray(data), memoryview(data), np.frombuffer(data, dtype=np.uint16)]:
+        im, key = enc.encode_bytes(payload, img_path="resources/small_image.png")
+        assert key == 256
+        assert dec.decode_bytes(key, img=im) == data
+
+    text = "héllo wörld ✓"
+    im, key = enc.encode_text(text, img_path="resources/small_image.png")
+    assert key == len(text.encode("utf-8"))
+    assert dec.decode_text(key, img=im) == text
+
+def test_helper_bytes2bits() -> None:
+    """
+    Testing bulk bytes to bits conversion against str2bin.
+    """
+
+    assert list(h.bytes2bits(b"hxV")) == h.str2bin("hxV")
+    assert h.bits2bytes(h.bytes2bits(b"hxV")) == b"hxV"
+
+def test_encode_stream() -> None:
+    """
+    Testing chunked encoding and decoding against encode_bytes.
+    """
+
+    with open('resources/encoded_text.txt', 'r') as file:
+        text = file.read().replace('\n', '')[:900]
+    data = text.encode("utf-8")
+
+    for bits, channels in [(1, "RGB"), (3, "RB"), (4, "G")]:
+        expected, key = enc.encode_bytes(data, img_path="resources/small_image.png", bits=bits, channels=channels)
+
+        chunks = [data[i:i+7] for i in range(0, len(data), 7)]
+        im, stream_key = enc.encode_stream(iter(chunks), img_path="resources/small_image.png", bits=bits, channels=channels)
+        assert stream_key == key
+        assert im.tobytes() == expected.tobytes()
+
+        im, stream_key = enc.encode_stream(io.StringIO(text), img_path="resources/small_image.png", bits=bits, channels=channels, chunk_size=5)
+        assert im.tobytes() == expected.tobytes()
+
+        decoded = list(dec.decode_stream(key, img=im, chunk_size=11))
+        assert all(len(chunk) == 11 for chunk in decoded[:-1])
+        assert b"".join(decoded) == data
+        assert "".join(dec.decode_stream(key, img=im, chunk_size=11, encoding="utf-8")) == text
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_stream([data, data], img_path="resources/small_image.png")
+    assert str(execinfo.value) == "TEXT DOES NOT FIT IN IMAGE"
+
+def test_encode_text_header() -> None:
+    """
+    Testing self-describing header encoding, keyless decoding and integrity checks.
+    """
+
+    text = "Hello World"
+    im, key = enc.encode_text(text, img_path="resources/small_image.png", bits=2, channels="RB", header=True)
+
+    header = dec.read_header(img=im)
+    assert (header.length, header.bits, header.channels) == (len(text), 2, "RB")
+
+    assert dec.decode_text(img=im) == text
+    assert dec.decode_text(key, img=im) == text
+    assert "".join(dec.decode_stream(img=im, chunk_size=4, encoding="utf-8")) == text
+
+    # flip one payload bit, past the 128 header pixels
+    arr = np.array(im)
+    arr[2, 28, 0] ^= 0b1
+    with pytest.raises(ValueError) as execinfo:
+        dec.decode_text(img=Image.fromarray(arr))
+    assert str(execinfo.value) == "PAYLOAD CHECKSUM MISMATCH"
+
+    with pytest.raises(ValueError) as execinfo:
+        dec.read_header(img_path="resources/small_image.png")
+    assert str(execinfo.value) == "IMAGE DOES NOT CONTAIN A HEADER"
+
+def test_scan_stencil_keys() -> None:
+    """
+    Testing single pass stencil key discovery.
+    """
+
+    im, key = enc.encode_stencil("Hello", img_path="resources/image.png", text_size=50, text_coords=(100, 100))
+    ranking = dec.scan_stencil_keys(img=im)
+
+    assert len(ranking) == 64
+    assert sum(count for code, count, score in ranking) == 1024*1024
+    assert ranking[0][0] == key%64
+
+    decoded = dec.decode_stencil(ranking[0][0], img=im, output="mask")
+    assert (decoded == dec.decode_stencil(key, img=im, output="mask")).all()
+
+    # flat background, where no neighbors differ in their next 2 bits
+    for color in [(120, 130, 140), (0, 0, 0), (255, 255, 255)]:
+        flat = Image.new("RGB", (300, 300), color)
+        background = h.pixel_codes(np.array(flat))[0, 0]
+        key = background
+
+        # a stencil with the background code is invisible
+        while (key%64 == background):
+            im, key = enc.encode_stencil("Secret", img=flat, text_size=60, text_coords=(20, 100))
+
+        assert dec.scan_stencil_keys(img=im)[0][0] == key%64
+
+def test_cache() -> None:
+    """
+    Testing the size-bounded LRU cache and stencil mask caching.
+    """
+
+    cache = c.LRUCache(10, sizeof=len)
+    cache.get("a", lambda: "aaaa")
+    cache.get("b", lambda: "bbbb")
+    assert cache.get("a", lambda: pytest.fail("UNEXPECTED MISS")) == "aaaa"
+
+    cache.get("c", lambda: "cccc") # evicts b, the least recently used
+    assert cache.get("b", lambda: "BBBB") == "BBBB"
+    assert cache.get("big", lambda: "x"*11) == "x"*11 # too large to cache
+    assert cache.stats() == {"hits": 1, "misses": 5, "evictions": 2, "entries": 2, "size": 8, "max_size": 10}
+
+    c.MASK_CACHE.clear()
+    im1, key1 = enc.encode_stencil("Hello", img_path="resources/small_image.png", text_size=20)
+    im2, key2 = enc.encode_stencil("Hello", img_path="resources/small_image.png", text_size=20)
+    assert c.MASK_CACHE.stats()["hits"] == 1
+    assert h.text_mask("Hello", 20) is h.text_mask("Hello", 20)
+    assert not h.text_mask("Hello", 20).flags.writeable
+
+def test_array_api() -> None:
+    """
+    Testing encoders and decoders on NumPy arrays, with and without inplace.
+    """
+
+    img = Image.open("resources/small_image.png").convert("RGB")
+    arr = np.array(img)
+    original = arr.copy()
+
+    # arrays in give arrays out, matching the image results, and the input is not touched
+    ea, key = enc.encode_text("hello", img=arr, header=True)
+    ei, _ = enc.encode_text("hello", img=img, header=True)
+    assert isinstance(ea, np.ndarray)
+    assert np.array_equal(ea, np.array(ei))
+    assert np.array_equal(arr, original)
+    assert dec.decode_text(img=ea) == "hello"
+
+    # inplace writes into the array itself
+    out, key = enc.encode_stencil("hi", img=arr, inplace=True)
+    assert out is arr
+    assert not np.array_equal(arr, original)
+    assert np.array_equal(dec.decode_stencil(key, img=arr, output="mask"), dec.decode_stencil(key, img=Image.fromarray(arr), output="mask"))
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text("hello", img=arr[:, ::2], inplace=True)
+    assert str(execinfo.value) == "INPLACE ARRAY MUST BE WRITABLE AND C-CONTIGUOUS"
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text("hello", img=arr.astype(np.float32))
+    assert str(execinfo.value) == "ARRAY MUST BE HxWx3 UINT8"
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text("hello", img=img, inplace=True)
+    assert str(execinfo.value) == "INPLACE REQUIRES AN ARRAY"
+
+def test_record_timings() -> None:
+    """
+    Testing per-stage timings are recorded inside record_timings only.
+    """
+
+    seen = []
+
+    with t.record_timings(seen.append) as timings:
+        im, key = enc.encode_text("hello", img_path="resources/small_image.png")
+        dec.decode_text(key, img=im)
+
+    enc.encode_text("hello", img_path="resources/small_image.png")
+
+    assert timings == seen
+    assert [s.stage for s in timings] == ["decode", "convert", "embed", "to_image", "decode", "convert", "extract"]
+    assert all(s.seconds >= 0 for s in timings)
+
+    summary = t.summarize(timings)
+    assert summary["convert"]["pixels"] == im.size[0]*im.size[1] + im.size[0]
+    assert summary["embed"]["pixels"] == 40
+
+def test_cli(tmp_path) -> None:
+    """
+    Testing the command line tool encodes and decodes a directory, resuming from its manifest.
+    """
+
+    src = tmp_path / "in"
+    (src / "sub").mkdir(parents=True)
+    Image.open("resources/small_image.png").save(src / "a.png")
+    Image.open("resources/small_image.png").save(src / "sub" / "b.png")
+    (src / "bad.png").write_bytes(b"not an image")
+
+    out, dec_dir = str(tmp_path / "out"), str(tmp_path / "dec")
+    assert cli.main(["encode", str(src), "-o", out, "-t", "hello", "--header", "-j", "1", "-q"]) == 1
+
+    records = [json.loads(line) for line in open(tmp_path / "out" / "manifest.jsonl")]
+    assert sorted(r["source"] for r in records if "error" in r) == [str(src / "bad.png")]
+
+    # a rerun skips every image already in the manifest
+    assert cli.main(["encode", str(src), "-o", out, "-t", "hello", "--header", "-j", "1", "-q"]) == 0
+    assert len(open(tmp_path / "out" / "manifest.jsonl").readlines()) == 3
+
+    assert cli.main(["decode", out, "-o", dec_dir, "--keys", str(tmp_path / "out" / "manifest.jsonl"), "-j", "1", "-q"]) == 0
+    assert (tmp_path / "dec" / "sub" / "b.txt").read_text() == "hello"
+
+    # .npy outputs are memory-mapped when decoded, in text and stencil mode
+    npy, npy_dec = str(tmp_path / "npy"), str(tmp_path / "npy_dec")
+    assert cli.main(["encode", str(src / "a.png"), "-o", npy, "-t", "hello", "--format", "npy", "-j", "1", "-q"]) == 0
+    assert cli.main(["decode", npy, "-o", npy_dec, "--keys", str(tmp_path / "npy" / "manifest.jsonl"), "-j", "1", "-q"]) == 0
+    assert (tmp_path / "npy_dec" / "a.txt").read_text() == "hello"
+
+    stencil, stencil_dec = str(tmp_path / "stencil"), str(tmp_path / "stencil_dec")
+    assert cli.main(["encode", str(src / "a.png"), "-o", stencil, "-m", "stencil", "-t", "hi", "--text-size", "20", "--format", "npy", "-j", "1", "-q"]) == 0
+    assert cli.main(["decode", stencil, "-o", stencil_dec, "-m", "stencil", "--keys", str(tmp_path / "stencil" / "manifest.jsonl"), "-j", "1", "-q"]) == 0
+
+    key = json.loads(open(tmp_path / "stencil" / "manifest.jsonl").readline())["key"]
+    decoded = np.array(Image.open(tmp_path / "stencil_dec" / "a.png"))
+    assert np.array_equal(decoded, dec.decode_stencil(key, img=fio.open_image(str(tmp_path / "stencil" / "a.npy"))))
+
+def test_cli_names(tmp_path, capsys) -> None:
+    """
+    Testing same-named images in different directories get separate outputs, and colliding inputs are rejected.
+    """
+
+    for sub in ["a", "b"]:
+        (tmp_path / "in" / sub).mkdir(parents=True)
+        Image.open("resources/small_image.png").save(tmp_path / "in" / sub / "x.png")
+
+    out = str(tmp_path / "out")
+    assert cli.main(["encode", str(tmp_path / "in" / "**" / "*.png"), "-o", out, "-t", "hi", "-j", "2", "-q"]) == 0
+
+    outputs = sorted(json.loads(line)["output"] for line in open(tmp_path / "out" / "manifest.jsonl"))
+    assert outputs == [str(tmp_path / "out" / "a" / "x.png"), str(tmp_path / "out" / "b" / "x.png")]
+
+    inputs = [str(tmp_path / "in" / "a" / "x.png"), str(tmp_path / "in" / "b" / "*.png")]
+    assert cli.main(["encode", *inputs, "-o", str(tmp_path / "out2"), "-t", "hi", "-q"]) == 2
+    assert "WOULD BOTH BE WRITTEN TO" in capsys.readouterr().err
+    assert not (tmp_path / "out2" / "x.png").exists()
+
+def test_encode_text_seed() -> None:
+    """
+    Testing scattered encoding round trips with the seed only, and reuses the cached pixel indexes.
+    """
+
+    text = "scattered text ✓"*20
+    img = Image.open("resources/small_image.png")
+
+    c.INDEX_CACHE.clear()
+    im, key = enc.encode_text(text, img=img, seed=7, bits=2, channels="RB")
+    assert dec.decode_text(key, img=im, seed=7) == text
+    assert dec.decode_text(key, img=im, seed=8) != text
+    assert "".join(dec.decode_stream(key, img=im, seed=7, chunk_size=5, encoding="utf-8")) == text
+    assert c.INDEX_CACHE.stats()["misses"] == 2 and c.INDEX_CACHE.stats()["hits"] == 2
+
+    # the payload is not packed into the first rows
+    changed = (np.array(im) != np.array(img.convert("RGB"))).any(axis=2)
+    assert np.flatnonzero(changed.any(axis=1)).max() > img.size[1] // 2
+
+    im, key = enc.encode_text(text[:100], img=img, seed=7, header=True)
+    assert dec.decode_text(img=im, seed=7) == text[:100]
+
+    with pytest.raises(ValueError) as execinfo:
+        dec.decode_text(img=im)
+    assert str(execinfo.value) == "SEED REQUIRED FOR SCATTERED PAYLOAD"
+
+def test_scatter_index() -> None:
+    """
+    Testing the scattered pixels are fixed for a seed, whatever the NumPy version.
+    """
+
+    assert h.scatter_index(7, (100, 100), 0, 8).tolist() == [1248, 1475, 2461, 6126, 7068, 8830, 8855, 9395]
+    assert h.scatter_index(1234, (1080, 1920), 6, 5).tolist() == [141521, 606064, 682782, 1208104, 1700924]
+
+    # every pixel from offset on is chosen exactly once
+    for size in [1, 2, 3, 17, 1000]:
+        assert sorted(h.permute_index(3, size, np.arange(size)).tolist()) == list(range(size))
+
+def test_encode_frames(tmp_path) -> None:
+    """
+    Testing a payload larger than one frame is spread across the frames of an animation and decoded back.
+    """
+
+    frames = [Image.open("resources/small_image.png").convert("RGB").rotate(90*i) for i in range(4)]
+    frames[0].save(tmp_path / "anim.png", save_all=True, append_images=frames[1:])
+
+    length, height = frames[0].size
+    data = bytes(random.getrandbits(8) for _ in range(length*height*3 // 8))
+    output = str(tmp_path / "encoded.tiff")
+
+    key = enc.encode_frames(data, output, img_path=str(tmp_path / "anim.png"), header=True)
+    assert Image.open(output).n_frames == 4
+    assert dec.decode_frames(key, img_path=output) == data
+    assert dec.decode_frames(img_path=output) == data
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_frames(data*2, str(tmp_path / "too_big.tiff"), img_path=str(tmp_path / "anim.png"))
+    assert str(execinfo.value) == "TEXT DOES NOT FIT IN IMAGE"
+    assert not (tmp_path / "too_big.tiff").exists()
+
+def test_fileio(tmp_path) -> None:
+    """
+    Testing uncompressed formats round trip through memory maps, and encoding in place writes through to the file.
+    """
+
+    arr = np.array(Image.open("resources/small_image.png").convert("RGB"))
+
+    for extension in ["npy", "bmp", "tiff"]:
+        path = str(tmp_path / f"image.{extension}")
+        fio.save_image(arr, path)
+        mapped = fio.open_image(path)
+        assert isinstance(mapped, np.memmap)
+        assert np.array_equal(mapped, arr)
+
+    path = str(tmp_path / "image.tiff")
+    mapped = fio.open_image(path, mode="r+")
+    _, key = enc.encode_text("hello", img=mapped, inplace=True)
+    mapped.flush()
+    assert dec.decode_text(key, img_path=path) == "hello"
+
+    fio.save_image(arr, str(tmp_path / "fast.png"), compress_level=1, strategy="rle")
+    assert np.array_equal(np.array(Image.open(tmp_path / "fast.png")), arr)
+
+    with pytest.raises(ValueError) as execinfo:
+        fio.open_image(str(tmp_path / "fast.png"))
+    assert str(execinfo.value) == "IMAGE MUST BE UNCOMPRESSED 8-BIT RGB"
+
+def test_aio() -> None:
+    """
+    Testing the coroutines round trip, and the pool rejects calls past its queue limit and times out slow calls.
+    """
+
+    async def run():
+        pool = aio.configure(max_workers=1, max_pending=2, queue_timeout=0.05)
+
+        im, key = await aio.aencode_text("hello", img_path="resources/small_image.png")
+        assert await aio.adecode_text(key, img=im) == "hello"
+
+        im, key = await aio.aencode_stencil("hi", img_path="resources/image.png")
+        assert (await aio.adecode_stencil(key, img=im, output="mask")).any()
+
+        results = await asyncio.gather(*[pool.run(time.sleep, 0.2) for _ in range(3)], return_exceptions=True)
+        assert [type(r) for r in results].count(aio.PoolBusy) == 1
+
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(time.sleep, 0.2, timeout=0.01)
+
+    asyncio.run(run())
+
+def test_stencil_many() -> None:
+    """
+    Testing stencil encoding and decoding of mixed-size batches in one call against decode_stencil.
+    """
+
+    imgs = [Image.open("resources/image.png"), Image.open("resources/small_image.png"), "resources/image.png", Image.open("resources/small_image.png")]
+    texts = ["hello", "hi", "many", "x"*100]
+
+    results = b.encode_stencil_many(texts, imgs)
+    assert isinstance(results[3], ValueError)
+
+    encoded = results[:3]
+    decoded = b.decode_stencil_many([key for _, key in encoded], [im for im, _ in encoded])
+
+    for (im, key), result in zip(encoded, decoded):
+        assert np.array_equal(np.array(result), np.array(dec.decode_stencil(key, img=im)))
+        assert dec.decode_stencil(key, img=im, output="mask").any()
+
+def test_encode_text_ecc() -> None:
+    """
+    Testing Hamming(7,4) coded payloads decode correctly with one flipped bit in every codeword.
+    """
+
+    text = "Hello World"
+    im, key = enc.encode_text(text, img_path="resources/small_image.png", header=True, ecc=True)
+    assert repr(key) == "TextKey(11, bits=1, channels='G', header=True, ecc=True, compression=None)"
+
+    # flip the first payload bit of every 7-bit codeword, past the 128 header pixels
+    arr = np.array(im)
+    flat = arr.reshape(-1, 3)
+    flat[128:128+len(text)*14:7, 1] ^= 0b1
+    assert dec.decode_text(img=Image.fromarray(arr)) == text
+
+    im, key = enc.encode_text(text, img_path="resources/small_image.png", bits=2, channels="RB", seed=7, ecc=True)
+    assert dec.decode_text(key, img=im, seed=7) == text
+    assert dec.decode_text(int(key), img=im, bits=2, channels="RB", seed=7, ecc=True) == text
+    assert "".join(dec.decode_stream(key, img=im, seed=7, chunk_size=3, encoding="utf-8")) == text
+
+def test_encode_text_compression() -> None:
+    """
+    Testing compressed payloads decode transparently, raise capacity, and are skipped when compression does not pay off.
+    """
+
+    # 17 KB of JSON lines, about 9 times the small image's raw capacity at 2 bits in RGB
+    text = "\n".join(json.dumps({"id": i, "level": "info", "message": "request served"}) for i in range(300))
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text(text, img_path="resources/small_image.png", bits=2, channels="RGB")
+    assert str(execinfo.value) == "TEXT DOES NOT FIT IN IMAGE"
+
+    for codec in ["zlib", "lzma", "bz2"]:
+        im, key = enc.encode_text(text, img_path="resources/small_image.png", bits=2, channels="RGB", header=True, compression=codec, compression_level=9)
+        assert key.compression == codec and key < len(text) // 10
+        assert dec.decode_text(key, img=im) == text
+        assert dec.decode_text(img=im) == text
+        assert "".join(dec.decode_stream(key, img=im, chunk_size=100, encoding="utf-8")) == text
+
+    im, key = enc.encode_stream(io.StringIO(text), img_path="resources/small_image.png", bits=2, channels="RGB", chunk_size=1000, compression="zlib")
+    assert dec.decode_text(key, img=im) == text
+    assert dec.decode_text(int(key), img=im, bits=2, channels="RGB", compression="zlib") == text
+
+    # random bytes do not compress, so they are embedded as is
+    data = np.random.default_rng(0).bytes(200)
+    im, key = enc.encode_bytes(data, img_path="resources/small_image.png", compression="lzma")
+    assert (key, key.compression) == (200, None)
+    assert dec.decode_bytes(key, img=im) == data
+
+    with pytest.raises(ValueError) as execinfo:
+        dec.decode_bytes(int(key), img=im, compression="zlib")
+    assert str(execinfo.value) == "INVALID COMPRESSED PAYLOAD"
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text(text, img_path="resources/small_image.png", compression="gzip")
+    assert str(execinfo.value) == "COMPRESSION MUST BE ONE OF zlib, lzma OR bz2"
+
+    # a payload inflating far past its compressed length is rejected unless max_size allows it
+    bomb = bytes(8 << 20)
+    for codec in ["zlib", "lzma", "bz2"]:
+        im, key = enc.encode_bytes(bomb, img_path="resources/image.png", header=True, compression=codec)
+
+        for decode in [lambda **kwargs: dec.decode_bytes(img=im, **kwargs), lambda **kwargs: b"".join(dec.decode_stream(img=im, chunk_size=16, **kwargs))]:
+            with pytest.raises(ValueError) as execinfo:
+                decode()
+            assert str(execinfo.value) == "DECOMPRESSED PAYLOAD EXCEEDS MAX SIZE"
+
+            assert decode(max_size=len(bomb)) == bomb
+
+def test_workers(monkeypatch) -> None:
+    """
+    Testing row-sharded embedding and stencil matching on threads give the same result as a single thread.
+    """
+
+    # shard even the small test images
+    monkeypatch.setattr(par, "MIN_SHARD_PIXELS", 7)
+    arr = np.array(Image.open("resources/image.png").convert("RGB"))
+    text = "sharded " * 500
+
+    for kwargs in [{"bits": 3, "channels": "RB"}, {"header": True, "seed": 3}, {"bits": 2, "channels": "RGB", "ecc": True}]:
+        expected, key = enc.encode_text(text, img=arr, **kwargs)
+        im, key = enc.encode_text(text, img=arr, workers=5, **kwargs)
+        assert np.array_equal(im, expected)
+        assert dec.decode_text(key, img=im, seed=kwargs.get("seed")) == text
+
+    random.seed(1)
+    expected, key = enc.encode_stencil("Sharded", img=arr, text_size=60, text_coords=(10, 20))
+    random.seed(1)
+    im, key = enc.encode_stencil("Sharded", img=arr, text_size=60, text_coords=(10, 20), workers=4)
+    assert np.array_equal(im, expected)
+
+    assert np.array_equal(dec.decode_stencil(key, img=im, workers=3), dec.decode_stencil(key, img=im))
+    assert np.array_equal(dec.decode_stencil(key, img=im, output="mask", workers=None), dec.decode_stencil(key, img=im, output="mask"))
+    assert par.shard_bounds(0, 10, 4) == [(0, 2), (2, 5), (5, 7), (7, 10)]
+
+    with pytest.raises(ValueError) as execinfo:
+        enc.encode_text(text, img=arr, workers=0)
+    assert str(execinfo.value) == "WORKERS MUST BE AT LEAST 1"
+
+def test_embed_bits() -> None:
+    """
+    Testing embed_bits and extract_bits round trip at every depth and channel set, from unaligned positions, leaving other slots untouched.
+    """
+
+    rng = np.random.default_rng(0)
+
+    for depth in range(1, 5):
+        for channels in ["G", "RB", "RG", "RGB"]:
+            arr = rng.integers(0, 256, (5, 7, 3), dtype=np.uint8)
+            total = 35*len(channels)*depth
+            before = h.extract_bits(arr, total, depth, channels)
+
+            start, count = 3*depth, total - 7*depth - 1
+            bits = rng.integers(0, 2, count, dtype=np.uint8)
+            h.embed_bits(arr, bits, depth, channels, start=start)
+
+            assert np.array_equal(h.extract_bits(arr, count, depth, channels, start=start), bits)
+            assert np.array_equal(h.extract_bits(arr, 5, depth, channels, start=start+1), bits[1:6])
+
+            after = h.extract_bits(arr, total, depth, channels)
+            end = -(-(start+count) // depth)*depth
+            assert np.array_equal(after[:start], before[:start]) and np.array_equal(after[end:], before[end:])
+
+def test_empty_payload() -> None:
+    """
+    Testing an empty text or payload round trips, decoding from a PNG path.
+    """
+
+    im, key = enc.encode_text("", img_path="resources/small_image.png")
+    im.save("resources/encoded_image.png")
+    assert key == 0
+
+    assert dec.decode_text(key, img_path="resources/encoded_image.png") == ""
+    assert dec.decode_bytes(0, img_path="resources/encoded_image.png") == b""
+    assert list(dec.decode_stream(key, img_path="resources/encoded_image.png")) == []
+    assert dec.decode_text(key, img=im) == ""